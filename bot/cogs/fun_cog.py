@@ -1,18 +1,23 @@
+import asyncio
 import datetime
 import random
 from textwrap import wrap
 from typing import Union
 
-import basc_py4chan
+import aiohttp
 import discord
 import requests
-from bs4 import BeautifulSoup
 from discord.ext import commands
 
-from lib.config import headers
+from lib.chan_catalog import catalogs, ChanError
+from lib.config import joke_store_path
 from lib.datetime_lib import random_date, custom_strftime
 from lib.emotes import basic_emoji, scoots_emoji
-from lib.wiki_fact import get_day_fact, WikipediaError
+from lib.joke_store import JokeStore
+from lib.wiki_fact import fact_store, get_day_fact, WikipediaError
+
+
+joke_store = JokeStore(joke_store_path)
 
 
 class Fun(commands.Cog):
@@ -21,6 +26,15 @@ class Fun(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+        # Keep local copy of Wikipedia's "on this day" events up to date
+        self.fact_refresh = self.bot.loop.create_task(fact_store.run(loop=self.bot.loop))
+        # Download all jokes once (continues after restart)
+        self.joke_builder = self.bot.loop.create_task(joke_store.build(loop=self.bot.loop))
+
+    def cog_unload(self):
+        self.fact_refresh.cancel()
+        self.joke_builder.cancel()
+
     @commands.command(name="deth", aliases=["death"], help="Find out when you or someone else will die.")
     async def deth(self, ctx, user: Union[discord.User, str, None]):
         """Displays random but consistent string"""
@@ -80,7 +94,7 @@ class Fun(commands.Cog):
 
         # Try to find an interesting fact
         try:
-            fact = get_day_fact(date)
+            fact = await get_day_fact(date, loop=self.bot.loop)
 
         # Error -> stop
         except WikipediaError as e:
@@ -96,31 +110,28 @@ class Fun(commands.Cog):
     async def joke(self, ctx):
         """Display a random 'joke'"""
 
-        url = "http://stupidstuff.org/jokes/joke.htm?jokeid={0}".format(random.randint(1, 3773))
+        joke = joke_store.random_joke()
 
-        # Attempt to download webpage
-        try:
-            response = requests.get(url, headers)
-            response.raise_for_status()
-        except requests.HTTPError:
-            fail = await ctx.send("Bad response (status code {0}) from {1})".format(response.status_code, url))
-            await fail.add_reaction(basic_emoji.get("Si"))
-            return
+        # No jokes downloaded yet -> download one now (a few IDs, some have no joke)
+        if joke is None:
+            missing = joke_store.missing()
+            for joke_id in random.sample(missing, min(3, len(missing))):
+                try:
+                    joke = await joke_store.fetch(joke_id, loop=self.bot.loop)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    continue
 
-        # Look for a joke
-        soup = BeautifulSoup(response.content, "html.parser")
-        table = soup.find("table", attrs={"class": "scroll"})
+                if joke is not None:
+                    break
 
-        # If element not found
-        if not table:
-            fail = await ctx.send("Joke not found on {0}".format(url))
+        if joke is None:
+            fail = await ctx.send("No jokes available " + basic_emoji.get("Sadge"))
             await fail.add_reaction(basic_emoji.get("Si"))
             return
 
-        for row in table.findAll("tr"):
-            # Send string with empty lines removed (split into smaller parts in case it is >2000 characters long)
-            for segment in wrap(str(row.text).replace("\n\n", "\n"), 1990):
-                await ctx.send(segment)
+        # Split into smaller parts in case it is >2000 characters long
+        for segment in wrap(joke, 1990):
+            await ctx.send(segment)
 
     @commands.command(name="chan", aliases=["4chan"], help="Get a random 4chan/4channel post.")
     async def chan(self, ctx, board: str = "", arg: str = ""):
@@ -131,45 +142,32 @@ class Fun(commands.Cog):
             board_list = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'gif', 'd', 'h', 'hr', 'k', 'm', 'o', 'p', 'r', 's', 't', 'u', 'v', 'vg', 'w', 'wg', 'i', 'ic', 'r9k', 'cm', 'hm', 'y', '3', 'adv', 'an', 'cgl', 'ck', 'co', 'diy', 'fa', 'fit', 'hc', 'int', 'jp', 'lit', 'mlp', 'mu', 'n', 'po', 'pol', 'sci', 'soc', 'sp', 'tg', 'toy', 'trv', 'tv', 'vp', 'wsg', 'x']
             board = random.choice(board_list)
 
-        # Attempt to download board
+        # Get board's catalog (cached for a while)
         try:
-            b = basc_py4chan.Board(board)
-            threads = b.get_all_threads()
+            catalog = await catalogs.get(board, loop=self.bot.loop)
 
-        # Invalid board specified (library uses requests)
-        except requests.exceptions.HTTPError:
-            msg = await ctx.send("`/{0}/` doesn't exist.".format(board))
+        # Invalid board specified or 4chan unreachable
+        except ChanError as e:
+            msg = await ctx.send(e)
             await msg.add_reaction(basic_emoji.get("Si"))
             return
 
-        result = ""
-        post = None
-
         # Finding a post with text
         if arg.lower() == "text" or arg.lower() == "txt":
-            # Try a random one until successful
-            while not post or not post.text_comment:
-                thread = random.choice(threads)
-                post = random.choice(thread.posts)
-                result = post.text_comment
+            result = catalog.random_text()
 
-        # Finding a post with image
+        # Finding a post with image (put in a spoiler)
         elif arg.lower() == "image" or arg.lower() == "img":
-            while not post or not post.has_file:
-                thread = random.choice(threads)
-                post = random.choice(thread.posts)
-                # Put image in a spoiler
-                result = "|| {0} ||\n{1}".format(post.file_url, post.text_comment)
+            result = catalog.random_image()
 
         # If no option specified -> find a post with text, image optional
         else:
-            while not post or not post.text_comment:
-                thread = random.choice(threads)
-                post = random.choice(thread.posts)
-                if post.has_file:
-                    result = "|| {0} ||\n{1}".format(post.file_url, post.text_comment)
-                else:
-                    result = post.text_comment
+            result = catalog.random_post()
+
+        if not result:
+            msg = await ctx.send("No such posts on `/{0}/` right now.".format(board))
+            await msg.add_reaction(basic_emoji.get("Si"))
+            return
 
         # Split into smaller parts if a post is too long (>2000 characters)
         for segment in wrap(result, 1990):
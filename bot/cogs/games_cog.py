@@ -9,7 +9,8 @@ from lib.connectX import Board as ConnectX
 from lib.discord_interface import add_choices_message, wait_for_choice, remove_choices
 from lib.emoji import extract_emoji
 from lib.emotes import basic_emoji
-from lib.minesweeper import Minesweeper
+from lib.minefield_pool import MinefieldPool, render_minefield
+from lib.minesweeper import MAX_NO_GUESS_DENSITY, Minesweeper, MinesweeperError, MinesweeperGame
 from lib.player import Player
 
 
@@ -19,6 +20,16 @@ class Games(commands.Cog):
         self.bot = bot
         self.user_icon = {self.bot.user.id: "🔴"}
 
+        # Minefields for common configurations, generated in the background
+        self.minefields = MinefieldPool()
+        self.minefield_producer = self.bot.loop.create_task(self.minefields.run(self.bot.loop))
+
+        # Interactive minesweeper games, channel ID -> (game, message displaying it)
+        self.sweeper_games = dict()
+
+    def cog_unload(self):
+        self.minefield_producer.cancel()
+
     def user_icons(self, user1: discord.User, user2: discord.User):
         """Return currently set user icons or default if not set"""
 
@@ -190,20 +201,136 @@ class Games(commands.Cog):
 
         await remove_choices(board_msg)
 
-    @commands.command(name="minesweeper", aliases=["mines"], help="Generate a minefield")
-    async def minesweeper(self, ctx, bombs: int = 25):
+    async def send_minefield(self, ctx, bombs: int, width: int, height: int, no_guess: bool) -> None:
+        """Validate parameters, generate minefield and display it"""
+
+        if not 1 <= width <= 100 or not 1 <= height <= 100:
+            await ctx.send("Board can be at most 100 tiles wide and 100 tiles tall.")
+            return
+        elif bombs >= width * height or no_guess and bombs > width * height - 9:
+            await ctx.send("That's too many bombs.")
+            return
+        elif no_guess and bombs > width * height * MAX_NO_GUESS_DENSITY:
+            await ctx.send("That's too many bombs for a minefield without guessing (at most {0:.0%} of tiles).".format(MAX_NO_GUESS_DENSITY))
+            return
+        elif bombs < 1:
+            await ctx.send("That wouldn't be minesweeper, just floorsweeper.")
+            return
+
+        # Take pre-generated field if there is one ready
+        config = (bombs, width, height, no_guess)
+        field = self.minefields.take(config)
+
+        # Otherwise generate it now (solvable fields can take a while -> don't block the event loop)
+        if field is None:
+            start = self.bot.loop.time()
+            try:
+                field = await self.bot.loop.run_in_executor(None, render_minefield, *config)
+            except MinesweeperError as e:
+                self.minefields.forget(config)
+                msg = await ctx.send(e)
+                await msg.add_reaction(basic_emoji.get("Si"))
+                return
+
+            # Keep fields of cheap configurations ready for next time
+            self.minefields.track(config, self.bot.loop.time() - start)
+
+        # Large boards don't fit into a single message (Discord's max message length is 2000)
+        for segment in field:
+            await ctx.send(segment)
+
+    @commands.command(name="minesweeper", aliases=["mines"], help="Generate a minefield, format: 'Bombs Width Height'.")
+    async def minesweeper(self, ctx, bombs: int = 25, width: int = 10, height: int = 10):
         """Displays a minefield"""
 
-        if bombs > 99:
+        await self.send_minefield(ctx, bombs, width, height, no_guess=False)
+
+    @commands.command(name="noguess", aliases=["safemines"], help="Generate a minefield solvable without guessing, format: 'Bombs Width Height'.")
+    async def noguess(self, ctx, bombs: int = 25, width: int = 10, height: int = 10):
+        """Displays a minefield solvable from the revealed tile without guessing"""
+
+        await self.send_minefield(ctx, bombs, width, height, no_guess=True)
+
+    @commands.command(name="sweep", help="Play a game of minesweeper (reveal tiles with 'p.reveal Column Row').")
+    async def sweep(self, ctx, bombs: int = 15):
+        """Start interactive minesweeper game in channel"""
+
+        if bombs > 91:
             await ctx.send("That's too many bombs.")
             return
+        elif bombs > 10 * 10 * MAX_NO_GUESS_DENSITY:
+            await ctx.send("That's too many bombs for a minefield without guessing (at most {0:.0%} of tiles).".format(MAX_NO_GUESS_DENSITY))
+            return
         elif bombs < 1:
             await ctx.send("That wouldn't be minesweeper, just floorsweeper.")
             return
 
-        field = Minesweeper(width=10, height=10, bombs=bombs)
+        try:
+            field = await self.bot.loop.run_in_executor(None, lambda: Minesweeper(width=10, height=10, bombs=bombs, no_guess=True))
+        except MinesweeperError as e:
+            msg = await ctx.send(e)
+            await msg.add_reaction(basic_emoji.get("Si"))
+            return
+
+        # Starting a new game replaces the one running in this channel
+        game = MinesweeperGame(field)
+        board_msg = await ctx.send(game.to_string() + "Reveal with `p.reveal Column Row`, flag with `p.flag Column Row`")
+        self.sweeper_games[ctx.channel.id] = (game, board_msg)
+
+    async def sweep_move(self, ctx, x: int, y: int, flag: bool) -> None:
+        """Reveal or flag tile in channel's minesweeper game"""
+
+        if ctx.channel.id not in self.sweeper_games:
+            await ctx.send("No minesweeper game is running here, start one with `p.sweep`.")
+            await ctx.message.add_reaction(basic_emoji.get("Si"))
+            return
+
+        game, board_msg = self.sweeper_games[ctx.channel.id]
+
+        if not 1 <= x <= game.width or not 1 <= y <= game.height:
+            await ctx.message.add_reaction(basic_emoji.get("Si"))
+            return
+
+        if flag:
+            if not game.flag(x - 1, y - 1):
+                await ctx.message.add_reaction(basic_emoji.get("Si"))
+                return
+            status = "{0} flagged {1} {2}".format(ctx.author.mention, x, y)
+
+        else:
+            exploded = game.reveal(x - 1, y - 1)
+            if exploded is None:
+                await ctx.message.add_reaction(basic_emoji.get("Si"))
+                return
+            elif exploded:
+                status = "💥 {0} stepped on a bomb!".format(ctx.author.mention)
+            elif game.won():
+                status = "{0} cleared the minefield!".format(ctx.author.mention)
+            else:
+                status = "{0} revealed {1} {2}".format(ctx.author.mention, x, y)
+
+        if game.over:
+            del self.sweeper_games[ctx.channel.id]
+
+        await board_msg.edit(content=game.to_string() + status)
+
+        # Keep chat clean, the board message shows the move
+        try:
+            await ctx.message.delete()
+        except (discord.Forbidden, discord.NotFound):
+            pass
+
+    @commands.command(name="reveal", aliases=["click"], help="Reveal tile in minesweeper game, format: 'Column Row'.")
+    async def reveal(self, ctx, x: int, y: int):
+        """Reveal tile in running minesweeper game"""
+
+        await self.sweep_move(ctx, x, y, flag=False)
+
+    @commands.command(name="flag", help="Flag tile in minesweeper game, format: 'Column Row'.")
+    async def flag(self, ctx, x: int, y: int):
+        """Toggle flag on tile in running minesweeper game"""
 
-        await ctx.send(field.to_string(spoiler=True))
+        await self.sweep_move(ctx, x, y, flag=True)
 
 
 def setup(bot):
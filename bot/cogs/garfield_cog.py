@@ -5,9 +5,12 @@ import asyncio
 import discord
 from discord.ext import commands
 
+from lib.config import strip_backfill_concurrency, strip_backfill_rate, strip_index_path
 from lib.datetime_lib import random_date, custom_strftime
 from lib.emotes import basic_emoji, scoots_emoji
-from lib.garfield_strip import garfield_strip, GarfieldError
+from lib.garfield_strip import garfield_strip, garfield_strips, strip_index, wait_for_strip, eastern_date, release_time, latest_release, GarfieldError
+from lib.strip_backfill import StripBackfill, FIRST_STRIP
+from lib.subscriptions import Subscriptions
 from lib.wiki_fact import get_day_fact, WikipediaError
 
 
@@ -17,7 +20,7 @@ async def verbose_garfield(ctx, date) -> None:
     status = await ctx.send(basic_emoji.get("hackerCD") + " Searching for Garfield strip " + basic_emoji.get("docSpin"))
 
     try:
-        comic = garfield_strip(date)
+        comic = await garfield_strip(date)
     except GarfieldError as e:
         await status.delete()
         await ctx.send(e)
@@ -27,26 +30,32 @@ async def verbose_garfield(ctx, date) -> None:
     await ctx.send(comic)
 
 
-def next_garfield() -> datetime.timedelta:
-    """Calculate timedelta between right now and next Garfield strip release"""
+async def parse_date(ctx, year: str, month: str, day: str):
+    """Parse date from command arguments, None (after telling user what's wrong) if they're not a date"""
 
-    now = datetime.datetime.utcnow()
-    tomorrow = now + datetime.timedelta(days=1)
+    if not year or not month or not day:
+        await ctx.send(basic_emoji.get("forsenT") + " Date looks like 'Year Month Day', ie. '2001 9 11'.")
+        await ctx.message.add_reaction(basic_emoji.get("Si"))
+        return None
 
-    # TODO: Add summer/wintertime offset
-    return datetime.datetime.combine(tomorrow, datetime.time.min) - now + datetime.timedelta(hours=6, minutes=7)
+    if not year.isnumeric() or not month.isnumeric() or not day.isnumeric():
+        await ctx.send(basic_emoji.get("forsenT") + " That's not even a numeric date.")
+        await ctx.message.add_reaction(basic_emoji.get("Si"))
+        return None
 
+    try:
+        return datetime.datetime(int(year), int(month), int(day))
+    except ValueError:
+        await ctx.send(basic_emoji.get("forsenSmug") + " No..? You must be using the wrong calendar.")
+        await ctx.message.add_reaction(basic_emoji.get("Si"))
+        return None
 
-async def daily_garfield(channel: discord.TextChannel):
-    """Post Garfield comic when it comes out to a channel"""
 
-    # Wait until next release
-    await asyncio.sleep(next_garfield().total_seconds())
+def format_delta(delta: datetime.timedelta) -> str:
+    """Format timedelta as HH:MM:SS"""
 
-    # Post today's Garfield strip and wait 24 hours
-    while True:
-        await verbose_garfield(channel, datetime.datetime.utcnow())
-        await asyncio.sleep(86400)
+    seconds = int(delta.total_seconds())
+    return "{0}:{1}:{2}".format(str(seconds // 3600).zfill(2), str(seconds // 60 % 60).zfill(2), str(seconds % 60).zfill(2))
 
 
 class Garfield(commands.Cog):
@@ -54,64 +63,114 @@ class Garfield(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+        # Channels getting the daily post
+        self.subscriptions = Subscriptions(strip_index_path)
+        self.daily_task = self.bot.loop.create_task(self.daily_garfield())
+
+        # Index whole strip archive in the background
+        self.backfill = StripBackfill(strip_index, concurrency=strip_backfill_concurrency, rate=strip_backfill_rate)
+        self.backfill_task = self.bot.loop.create_task(self.backfill.run(loop=self.bot.loop))
+
+    def cog_unload(self):
+        self.backfill_task.cancel()
+        self.daily_task.cancel()
+
+    def daily_channels(self) -> list:
+        """Subscribed channels (skipping ones not in cache right now), first channel of the first guild if there are none"""
+
+        channels = []
+        for channel_id in self.subscriptions.channels:
+            # Missing from cache doesn't mean deleted (guild unavailable during an outage, cache not ready yet)
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                channels.append(channel)
+
+        if not channels and self.bot.guilds and self.bot.guilds[0].text_channels:
+            channels.append(self.bot.guilds[0].text_channels[0])
+
+        return channels
+
+    async def daily_garfield(self) -> None:
+        """Post every new Garfield strip to all subscribed channels as soon as it comes out"""
+
+        while True:
+            now = datetime.datetime.utcnow()
+            date = eastern_date(now)
+            if now >= release_time(date):
+                date += datetime.timedelta(days=1)
+
+            # Start checking at release (earlier dates are refused), strip gets scraped (and indexed) once for all channels
+            await asyncio.sleep(max(0.0, (release_time(date) - now).total_seconds()))
+            comic = await wait_for_strip(date, loop=self.bot.loop)
+            if comic is None:
+                continue
+
+            channels = self.daily_channels()
+            results = await asyncio.gather(*(channel.send(comic) for channel in channels), return_exceptions=True)
+
+            # Channel deleted (or bot can't post there anymore) -> unsubscribe it
+            for channel, result in zip(channels, results):
+                if isinstance(result, (discord.NotFound, discord.Forbidden)):
+                    self.subscriptions.remove(channel.id)
+
+            # Don't post the same date twice
+            await asyncio.sleep(max(0.0, (release_time(date) - datetime.datetime.utcnow()).total_seconds()) + 1)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        """Forget subscription of deleted channel"""
+
+        self.subscriptions.remove(channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        """Forget subscriptions of guild the bot left (or was kicked from)"""
+
+        self.subscriptions.remove_guild(guild.id)
+
     @commands.command(name="today", help="Get today's Garfield comic.")
     async def today(self, ctx):
         """Display today's Garfield strip"""
 
         now = datetime.datetime.utcnow()
+        today = eastern_date(now)
 
         # If today's comic isn't out yet
-        # TODO: Add summer/wintertime offset
-        if now.hour < 6 or (now.hour == 6 and now.minute < 7):
-            release = datetime.datetime(now.year, now.month, now.day, 6, 7, 0, 0)
-            delta = (release - now)
-            hours = delta.seconds // 3600 % 24
-            minutes = delta.seconds // 60 % 60
-            seconds = delta.seconds - hours * 3600 - minutes * 60
-            await ctx.send("You will have to be patient, today's comic comes out in {0}:{1}:{2}.".format(str(hours).zfill(2), str(minutes).zfill(2), str(seconds).zfill(2)))
+        if now < release_time(today):
+            await ctx.send("You will have to be patient, today's comic comes out in {0}.".format(format_delta(release_time(today) - now)))
             return
 
-        await verbose_garfield(ctx, now)
+        await verbose_garfield(ctx, today)
 
     @commands.command(name="yesterday", help="Get yesterday's Garfield comic.")
     async def yesterday(self, ctx):
         """Display yesterday's Garfield comic"""
 
-        now = datetime.datetime.utcnow()
-        await verbose_garfield(ctx, now - datetime.timedelta(days=1))
+        await verbose_garfield(ctx, eastern_date(datetime.datetime.utcnow()) - datetime.timedelta(days=1))
 
     @commands.command(name="tomorrow", help="Get tomorrow's Garfield comic? Unless??")
     async def tomorrow(self, ctx):
         """Display when tomorrow's Garfield comic comes out"""
 
-        # Calculate timedelta
-        delta = next_garfield()
-        hours = delta.seconds // 3600 % 24
-        minutes = delta.seconds // 60 % 60
-        seconds = delta.seconds - hours * 3600 - minutes * 60
-
-        # If next garfield actually comes out today, simply add 24 hours for tomorrow's
         now = datetime.datetime.utcnow()
-        # TODO: Add summer/wintertime offset
-        if now.hour < 6 or (now.hour == 6 and now.minute < 7):
-            hours += 24
+        delta = release_time(eastern_date(now) + datetime.timedelta(days=1)) - now
 
         await ctx.message.add_reaction(basic_emoji.get("Si"))
-        await ctx.send("You will have to be patient, tomorrow's comic comes out in {0}:{1}:{2}.".format(str(hours).zfill(2), str(minutes).zfill(2), str(seconds).zfill(2)))
+        await ctx.send("You will have to be patient, tomorrow's comic comes out in {0}.".format(format_delta(delta)))
 
     @commands.command(name="random", help="Get random Garfield comic.")
     async def rand_date(self, ctx):
         """Display random Garfield strip + interesting fact about that day"""
-        date = random_date(datetime.datetime(1978, 6, 19), datetime.datetime.utcnow())
+        date = random_date(FIRST_STRIP, latest_release(datetime.datetime.utcnow()) + datetime.timedelta(days=1))
 
         await verbose_garfield(ctx, date)
 
         status = await ctx.send("Looking up an interesting fact... " + basic_emoji.get("docSpin"))
         msg = "This comic came out in " + custom_strftime("%B {S}, %Y", date) + "."
 
-        # Try to find an interesting fact
+        # Try to find an interesting fact, preferably from the same year
         try:
-            fact = get_day_fact(date)
+            fact = await get_day_fact(date, loop=self.bot.loop, years=[(date.year, date.year), (date.year - 5, date.year + 5)])
 
         # Error -> stop
         except WikipediaError as e:
@@ -127,27 +186,84 @@ class Garfield(commands.Cog):
     async def garf(self, ctx, arg1: str = "", arg2: str = "", arg3: str = ""):
         """Get specific Garfield comic"""
 
-        # Parsing input
-        if not arg1 or not arg2 or not arg3:
-            await ctx.send(basic_emoji.get("forsenT") + " Date looks like 'Year Month Day', ie. '2001 9 11'.")
+        date = await parse_date(ctx, arg1, arg2, arg3)
+        if date is None:
+            return
+
+        # Send comic strip
+        await verbose_garfield(ctx, date)
+
+    @commands.command(name="garfs", aliases=["garfields"], help="Get several consecutive Garfield comics, format: 'Year Month Day Days' (a week by default).")
+    async def garfs(self, ctx, arg1: str = "", arg2: str = "", arg3: str = "", arg4: str = "7"):
+        """Get up to a month of Garfield comics at once"""
+
+        date = await parse_date(ctx, arg1, arg2, arg3)
+        if date is None:
+            return
+
+        if not arg4.isnumeric() or not 1 <= int(arg4) <= 31:
+            await ctx.send(basic_emoji.get("forsenT") + " Number of days has to be between 1 and 31.")
             await ctx.message.add_reaction(basic_emoji.get("Si"))
             return
 
-        if not arg1.isnumeric() or not arg2.isnumeric() or not arg3.isnumeric():
-            await ctx.send(basic_emoji.get("forsenT") + " That's not even a numeric date.")
+        # Only dates with released strips
+        last = min(date + datetime.timedelta(days=int(arg4) - 1), latest_release(datetime.datetime.utcnow()))
+        date = max(date, FIRST_STRIP)
+        if date > last:
+            await ctx.send("There are no Garfield comics from those days " + basic_emoji.get("forsenSmug"))
             await ctx.message.add_reaction(basic_emoji.get("Si"))
             return
+        dates = [date + datetime.timedelta(days=i) for i in range((last - date).days + 1)]
 
-        # Construct date
-        try:
-            date = datetime.datetime(int(arg1), int(arg2), int(arg3))
-        except ValueError:
-            await ctx.send(basic_emoji.get("forsenSmug") + " No..? You must be using the wrong calendar.")
+        status = None
+        if any(day not in strip_index for day in dates):
+            status = await ctx.send(basic_emoji.get("hackerCD") + " Searching for Garfield strips " + basic_emoji.get("docSpin"))
+
+        comics = await garfield_strips(dates, loop=self.bot.loop)
+
+        if status:
+            await status.delete()
+
+        # As few messages as possible (Discord shows at most 10 link previews per message)
+        links = [comic for comic in comics if isinstance(comic, str)]
+        errors = [custom_strftime("%B {S}, %Y", day) + ": " + str(comic) for day, comic in zip(dates, comics) if not isinstance(comic, str)]
+
+        for i in range(0, len(links), 10):
+            await ctx.send("\n".join(links[i:i + 10]))
+        if errors:
+            await ctx.send("\n".join(errors)[:2000])
+
+    @commands.command(name="subscribe", aliases=["sub"], help="Post every new Garfield comic to this channel.")
+    @commands.guild_only()
+    async def subscribe(self, ctx):
+        """Subscribe channel to the daily Garfield post"""
+
+        if not ctx.channel.permissions_for(ctx.author).manage_channels:
+            await ctx.send("🔒 You need permission to manage this channel " + basic_emoji.get("Pepega"))
             await ctx.message.add_reaction(basic_emoji.get("Si"))
             return
 
-        # Send comic strip
-        await verbose_garfield(ctx, date)
+        if not self.subscriptions.add(ctx.channel.id, ctx.guild.id):
+            await ctx.send("This channel is already subscribed " + basic_emoji.get("forsenScoots"))
+            return
+
+        await ctx.send("New Garfield comics will be posted here.")
+
+    @commands.command(name="unsubscribe", aliases=["unsub"], help="Stop posting new Garfield comics to this channel.")
+    @commands.guild_only()
+    async def unsubscribe(self, ctx):
+        """Unsubscribe channel from the daily Garfield post"""
+
+        if not ctx.channel.permissions_for(ctx.author).manage_channels:
+            await ctx.send("🔒 You need permission to manage this channel " + basic_emoji.get("Pepega"))
+            await ctx.message.add_reaction(basic_emoji.get("Si"))
+            return
+
+        if not self.subscriptions.remove(ctx.channel.id):
+            await ctx.send("This channel isn't subscribed " + basic_emoji.get("forsenScoots"))
+            return
+
+        await ctx.send("Garfield comics won't be posted here anymore.")
 
 
 def setup(bot):
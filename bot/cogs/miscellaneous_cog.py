@@ -22,6 +22,12 @@ class Miscellaneous(commands.Cog):
         ms = (datetime.utcnow() - ctx.message.created_at).total_seconds() * 1000
         await ctx.send(basic_emoji.get("Pepega") + " 🏓 Pong! `{0}ms`".format(int(ms)))
 
+    @commands.command(name="stalls", aliases=["lag"], help="Display commands blocking the bot.")
+    async def stalls(self, ctx):
+        """Displays event loop stall counters per command"""
+
+        await ctx.send(self.bot.watchdog.report())
+
     @commands.command(name="roll", help="Generate a random number between 1 and 100 by default.")
     async def roll(self, ctx, num: str = "100"):
         """Roll a dice"""
@@ -1,15 +1,19 @@
 import asyncio
 import ctypes
 import random
+import time
 from textwrap import wrap
 
 import discord
+import youtube_dl
 from discord.ext import commands
 
-from lib.discord_session import Session
-from lib.discord_session import Player
+from lib.config import metrics_file, session_idle_timeout
+from lib.discord_session import Session, SessionRegistry
+from lib.discord_session import Player, extract_playlist
 from lib.emotes import basic_emoji, dance_emoji, dance_react
-from lib.youtube_tools import select_video
+from lib.metrics import music_metrics
+from lib.youtube_tools import playlist_url, select_video
 
 
 class Music(commands.Cog):
@@ -17,19 +21,30 @@ class Music(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
-        self.sessions = dict()
-        for guild in self.bot.guilds:
-            self.sessions[guild.id] = Session()
+
+        # Sessions are created once a guild uses music commands, idle ones leave voice and get freed
+        self.sessions = SessionRegistry(session_idle_timeout)
+        self.session_reaper = self.bot.loop.create_task(self.sessions.run())
+
+        self.metrics_exporter = None
+        if metrics_file:
+            self.metrics_exporter = self.bot.loop.create_task(music_metrics.export(metrics_file, loop=self.bot.loop))
 
         # Load library to be able to transmit audio packets
         discord.opus.load_opus(ctypes.util.find_library("opus"))
 
+    def cog_unload(self):
+        self.session_reaper.cancel()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.cancel()
+        self.bot.loop.create_task(self.sessions.close_all())
+
     @commands.command(name="play", aliases=["resume", "unpause"], help="Join VC and play music.")
     @commands.guild_only()
     async def play(self, ctx, *args):
         """Play or resume music"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         # No arguments and nothing is playing -> exit
         if not args and (session.vc is None or not session.vc.is_paused()):
@@ -61,71 +76,142 @@ class Music(commands.Cog):
             await ctx.send("Resumed playing " + random.choice(dance_emoji))
             return
 
-        # Extract youtube video url
+        # Extract youtube video url(s)
         arg = " ".join(str(i) for i in args)
-        url = await select_video(self.bot, ctx, arg)
+        urls = await self.select_songs(ctx, arg)
 
         # No video selected by user
-        if not url:
+        if not urls:
             return
 
         await session.connect(channel)
 
-        # Add song to queue
-        session.song_queue.append(url)
-        if session.vc.is_playing():
-            await ctx.send("Song added to queue.")
+        # Add song(s) to queue
+        session.enqueue(urls)
+        music_metrics.gauge("queue_depth", self.sessions.queued())
+        session.channel = ctx.channel
+
+        # Something is already playing (or downloading) -> its task will get to this song
+        if session.task is not None and not session.task.done():
+            session.prefetch(self.bot.loop)
+            await ctx.send("Song added to queue." if len(urls) == 1 else "{0} songs added to queue.".format(len(urls)))
             return
 
+        if len(urls) > 1:
+            await ctx.send("{0} songs added to queue.".format(len(urls)))
+
+        session.task = self.bot.loop.create_task(self.play_queue(session))
+
+    async def select_songs(self, ctx, query: str) -> list:
+        """Return URLs of whole playlist or of single video selected by user (empty list if none)"""
+
+        playlist = playlist_url(query)
+        if not playlist:
+            session = self.sessions.get(ctx.guild.id)
+            url = await select_video(self.bot, ctx, query, speculate=lambda u: session.speculate(u, self.bot.loop))
+            return [url] if url else []
+
+        try:
+            urls = await extract_playlist(playlist, loop=self.bot.loop, guild=ctx.guild.id)
+        except youtube_dl.utils.DownloadError:
+            msg = await ctx.send("Couldn't load playlist " + basic_emoji.get("Sadge"))
+            await msg.add_reaction(basic_emoji.get("Si"))
+            return []
+
+        if not urls:
+            msg = await ctx.send("0 videos found. " + basic_emoji.get("Sadge"))
+            await msg.add_reaction(basic_emoji.get("Si"))
+
+        return urls
+
+    async def play_queue(self, session: Session) -> None:
+        """Play songs until queue is empty (one task per guild), then leave voice"""
+
+        channel = session.channel
+
+        # When previous song stopped playing (time.monotonic), to measure gaps between songs
+        previous_end = None
+
         while session.song_queue:
             # Bot kicked from channel
             if session.vc is None or not session.vc.is_connected():
                 session.reset()
-                await ctx.send("Kicked from voice channel " + basic_emoji.get("FeelsWeirdMan") + " 🖕")
+                await channel.send("Kicked from voice channel " + basic_emoji.get("FeelsWeirdMan") + " 🖕")
                 return
 
-            session.song = session.song_queue.pop(0)
-            # Attempt to download video
+            session.song = session.song_queue.popleft()
+            session.touch()
+            music_metrics.gauge("queue_depth", self.sessions.queued())
+            requested = time.monotonic()
+            download = session.take_prefetched(session.song)
+            info = session.take_resolved(session.song)
+
+            # Only show status if song wasn't prefetched (or resolved) already
+            status = None
+            if (download is None or not download.done()) and (info is None or not info.done()):
+                status = await channel.send("Downloading... " + basic_emoji.get("docSpin"))
+
+            # Attempt to download video (or at least start streaming it)
             try:
-                status = await ctx.send("Downloading... " + basic_emoji.get("docSpin"))
-                player = await asyncio.wait_for(Player.from_url(session.song, loop=self.bot.loop), timeout=120)
+                player = await asyncio.wait_for(Player.progressive(session.song, loop=self.bot.loop, download=download, info=info, guild=session.guild_id), timeout=120)
 
             # Timed out
             except asyncio.TimeoutError:
-                await status.delete()
-                await ctx.send("Download timed out (120 seconds), `" + session.song + "` skipped " + basic_emoji.get("Si"))
+                if status:
+                    await status.delete()
+                await channel.send("Download timed out (120 seconds), `" + session.song + "` skipped " + basic_emoji.get("Si"))
                 continue
 
             # Other exception
-            except:
-                await status.delete()
-                await ctx.send("Download failed (possibly age-restricted video), `" + session.song + "` skipped " + basic_emoji.get("Si"))
+            except Exception:
+                if status:
+                    await status.delete()
+                await channel.send("Download failed (possibly age-restricted video), `" + session.song + "` skipped " + basic_emoji.get("Si"))
                 continue
 
-            await status.delete()
+            if status:
+                await status.delete()
 
             # Bot kicked from vc while downloading -> return to "empty" state (no vc, nothing queued)
             if session.vc is None or not session.vc.is_connected():
+                # Never played, so voice client won't clean the player up (stop decoding, unpin cached file)
+                player.cleanup()
                 session.reset()
-                await ctx.send("Kicked from voice channel " + basic_emoji.get("FeelsWeirdMan") + " 🖕")
+                await channel.send("Kicked from voice channel " + basic_emoji.get("FeelsWeirdMan") + " 🖕")
                 return
 
-            session.vc.play(player)
-            title = await ctx.send(random.choice(dance_emoji) + " 🎶 Now playing 🎶: `" + player.title + "` " + random.choice(dance_emoji))
+            # Download next songs while this one plays
+            session.prefetch(self.bot.loop)
+            title = await channel.send(random.choice(dance_emoji) + " 🎶 Now playing 🎶: `" + player.title + "` " + random.choice(dance_emoji))
             await title.add_reaction(random.choice(dance_react))
 
-            while (session.vc.is_playing() or session.vc.is_paused()) and session.vc.is_connected():
-                await asyncio.sleep(1)
+            await session.play(player, self.bot.loop)
+
+            # Direct stream didn't produce any audio (and song wasn't skipped) -> play downloaded file instead
+            if player.streamed and not player.packets and session.song and session.vc.is_connected():
+                try:
+                    player = Player.from_data(await asyncio.wait_for(player.download, timeout=120))
+                except Exception:
+                    await channel.send("Download failed (possibly age-restricted video), `" + session.song + "` skipped " + basic_emoji.get("Si"))
+                    continue
+
+                await session.play(player, self.bot.loop)
+
+            # Time from song being needed (and from previous song stopping) to its first audio packet
+            if player.started is not None:
+                music_metrics.observe("first_audio_seconds", player.started - requested)
+                if previous_end is not None:
+                    music_metrics.observe("track_gap_seconds", player.started - previous_end)
 
             while session.repeat and session.vc.is_connected():
-                session.vc.play(player.revive(player))
-                while (session.vc.is_playing() or session.vc.is_paused()) and session.vc.is_connected():
-                    await asyncio.sleep(1)
+                await session.play(player.revive(player), self.bot.loop)
+
+            previous_end = time.monotonic()
 
         # Bot kicked from vc while playing
         if not session.vc.is_connected():
             session.reset()
-            await ctx.send("Kicked from voice channel " + basic_emoji.get("FeelsWeirdMan") + " 🖕")
+            await channel.send("Kicked from voice channel " + basic_emoji.get("FeelsWeirdMan") + " 🖕")
             return
 
         # Leave voice after last song
@@ -137,7 +223,7 @@ class Music(commands.Cog):
     async def forceplay(self, ctx, *args):
         """Put song in front of queue"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         # No arguments -> exit
         if not args:
@@ -150,23 +236,25 @@ class Music(commands.Cog):
             await ctx.message.add_reaction(basic_emoji.get("Si"))
             return
 
-        # Extract youtube video url
+        # Extract youtube video url(s)
         arg = " ".join(str(i) for i in args)
-        url = await select_video(self.bot, ctx, arg)
+        urls = await self.select_songs(ctx, arg)
 
         # No video selected by user
-        if not url:
+        if not urls:
             return
 
-        session.forceplay(url)
-        await ctx.send("Song inserted to the front of the queue.")
+        session.enqueue(urls, front=True)
+        music_metrics.gauge("queue_depth", self.sessions.queued())
+        session.prefetch(self.bot.loop)
+        await ctx.send("Song inserted to the front of the queue." if len(urls) == 1 else "{0} songs inserted to the front of the queue.".format(len(urls)))
 
     @commands.command(name="queue", help="Display songs in queue.")
     @commands.guild_only()
     async def queue(self, ctx):
         """Display queue"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         for segment in wrap(session.queue_to_string(), 1995):
             await ctx.send(segment)
@@ -176,13 +264,13 @@ class Music(commands.Cog):
     async def clear(self, ctx):
         """Clear song queue"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         if not session.song_queue:
             await ctx.send("Queue already empty " + basic_emoji.get("forsenScoots"))
             return
 
-        session.song_queue = []
+        session.clear()
         await ctx.send("Queue emptied.")
 
     @commands.command(name="skip", aliases=["next"], help="Skip current song.")
@@ -190,7 +278,7 @@ class Music(commands.Cog):
     async def skip(self, ctx):
         """Play next song in queue"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         if not session.next_song():
             msg = await ctx.send("Nothing is playing.")
@@ -201,7 +289,7 @@ class Music(commands.Cog):
     async def pause(self, ctx):
         """Pause current song"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         if session.vc.pause():
             await ctx.send(basic_emoji.get("residentCD") + " Paused " + basic_emoji.get("Okayga"))
@@ -215,7 +303,7 @@ class Music(commands.Cog):
     async def repeat(self, ctx):
         """Toggle repeat"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         if not session.song:
             msg = await ctx.send("Nothing is playing.")
@@ -230,7 +318,7 @@ class Music(commands.Cog):
     async def stop(self, ctx):
         """Stop playback"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         if not session.stop():
             msg = await ctx.send("Nothing is playing.")
@@ -241,7 +329,7 @@ class Music(commands.Cog):
     async def playing(self, ctx):
         """Display currently playing song"""
 
-        session = self.sessions[ctx.guild.id]
+        session = self.sessions.get(ctx.guild.id)
 
         if not session.song:
             msg = await ctx.send("Nothing is playing.")
@@ -251,6 +339,19 @@ class Music(commands.Cog):
             title = await ctx.send(random.choice(dance_emoji) + " 🎶 Now playing 🎶: " + session.song)
             await title.add_reaction(random.choice(dance_react))
 
+    @commands.command(name="musicstats", aliases=["mstats"], help="Display music download and playback statistics.")
+    async def musicstats(self, ctx):
+        """Display music pipeline timings and counters"""
+
+        lines = []
+        for name, hits, misses in (("Audio cache", "audio_cache_hits", "audio_cache_misses"), ("Search cache", "search_cache_hits", "search_cache_misses")):
+            rate = music_metrics.ratio(hits, misses)
+            if rate is not None:
+                lines.append("{0} hit rate `{1:.0%}`".format(name, rate))
+
+        for segment in wrap("\n".join(lines + [music_metrics.report()]), 1995, replace_whitespace=False):
+            await ctx.send(segment)
+
 
 def setup(bot):
     bot.add_cog(Music(bot))
@@ -0,0 +1,170 @@
+import json
+import os
+import re
+import urllib.parse
+from collections import Counter, OrderedDict
+
+
+# Files written by youtube-dl into the cache ('<extractor>-<id>.<ext>' and its leftovers of interrupted downloads)
+CACHE_FILE = re.compile(r"^[\w:]+-[\w-]+\.(webm|m4a|mp4|mp3|opus|ogg|aac|flac|wav|3gp)(\.part(-Frag\d+)?|\.ytdl)?$")
+
+
+class AudioCache:
+    """Downloaded audio files keyed by extractor and video ID, kept under a total size budget
+
+    Least recently used files are deleted first. Index of cached files is saved next to them as JSON
+    (in LRU order as of the last change of cached files), so the cache survives restarts.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        # Key -> minimal video info ('extractor', 'id', 'ext', 'title', 'size', 'gain'), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+
+        # Key -> number of players currently using the file (pinned files are never evicted)
+        self.pinned = Counter()
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.json")
+
+    @staticmethod
+    def key(data: dict) -> str:
+        """Cache key of extracted video info"""
+
+        return "{0}-{1}".format(data["extractor"], data["id"])
+
+    @staticmethod
+    def key_from_url(url: str):
+        """Cache key of Youtube URL (without extracting it), None if not a recognized video URL"""
+
+        parsed = urllib.parse.urlparse(url)
+
+        if parsed.netloc.endswith("youtu.be"):
+            video_id = parsed.path.lstrip("/")
+        elif parsed.netloc.endswith("youtube.com") and parsed.path == "/watch":
+            video_id = urllib.parse.parse_qs(parsed.query).get("v", [""])[0]
+        else:
+            return None
+
+        return "youtube-" + video_id if video_id else None
+
+    def path(self, entry: dict) -> str:
+        return os.path.join(self.directory, "{0}-{1}.{2}".format(entry["extractor"], entry["id"], entry["ext"]))
+
+    def get(self, key):
+        """Return cached video info and mark it as recently used, None if not cached"""
+
+        if key is None or key not in self.entries:
+            return None
+
+        # Index isn't saved here (it's saved by the next add), playback shouldn't wait for a rewrite of the whole index
+        entry = self.entries[key]
+        if not os.path.isfile(self.path(entry)):
+            self.size -= self.entries.pop(key)["size"]
+            return None
+
+        self.entries.move_to_end(key)
+
+        return entry
+
+    def add(self, data: dict, filename: str) -> None:
+        """Register downloaded file, evict least recently used files over budget"""
+
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            return
+
+        key = self.key(data)
+        gain = self.entries[key].get("gain") if key in self.entries else None
+        if key in self.entries:
+            self.size -= self.entries.pop(key)["size"]
+
+        self.entries[key] = {
+            "extractor": data["extractor"],
+            "id": data["id"],
+            "ext": data["ext"],
+            "title": data.get("title"),
+            "size": size,
+            "gain": gain
+        }
+        self.size += size
+
+        self.evict()
+        self._save()
+
+    def gain(self, key: str):
+        """Return measured volume gain (dB) of cached track, None if unknown"""
+
+        entry = self.entries.get(key)
+        return entry.get("gain") if entry else None
+
+    def set_gain(self, key: str, gain) -> None:
+        """Remember volume gain (dB) of cached track, so loudness is measured only once"""
+
+        if gain is not None and key in self.entries:
+            self.entries[key]["gain"] = gain
+            self._save()
+
+    def pin(self, key: str) -> None:
+        self.pinned[key] += 1
+
+    def unpin(self, key: str) -> None:
+        self.pinned[key] -= 1
+        if self.pinned[key] <= 0:
+            del self.pinned[key]
+
+    def evict(self) -> None:
+        """Delete least recently used (and not currently played) files until cache fits into budget"""
+
+        for key in list(self.entries):
+            if self.size <= self.max_bytes:
+                break
+            if key in self.pinned:
+                continue
+
+            entry = self.entries.pop(key)
+            self.size -= entry["size"]
+            try:
+                os.remove(self.path(entry))
+            except OSError:
+                pass
+
+    def _load(self) -> None:
+        """Load index, drop entries with missing files and delete cache files missing from index (other files are left alone)"""
+
+        try:
+            with open(self.index_path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            entries = []
+
+        for entry in entries:
+            if os.path.isfile(self.path(entry)):
+                self.entries[self.key(entry)] = entry
+                self.size += entry["size"]
+
+        known = {os.path.basename(self.path(entry)) for entry in self.entries.values()}
+        for name in os.listdir(self.directory):
+            if name not in known and CACHE_FILE.match(name) and os.path.isfile(os.path.join(self.directory, name)):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+        self.evict()
+        self._save()
+
+    def _save(self) -> None:
+        """Write index (atomically, so a crash can't leave it half-written)"""
+
+        with open(self.index_path + ".tmp", "w") as file:
+            json.dump(list(self.entries.values()), file)
+        os.replace(self.index_path + ".tmp", self.index_path)
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import random
+from collections import OrderedDict
+
+import aiohttp
+from basc_py4chan.util import clean_comment_body
+
+from lib.config import chan_catalog_ttl
+from lib.http_session import get_http_session
+
+
+CATALOG_URL = "https://a.4cdn.org/{0}/catalog.json"
+IMAGE_URL = "https://i.4cdn.org/{0}/{1}{2}"
+
+
+class ChanError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class BoardCatalog:
+    """Posts of a board's catalog (threads' opening posts and latest replies), indexed for sampling"""
+
+    def __init__(self, board: str, catalog: list):
+        self.board = board
+
+        # (text, image URL or None) of posts with text, (image URL, text) of posts with an image
+        self.texts = []
+        self.images = []
+
+        for page in catalog:
+            for thread in page.get("threads", []):
+                for post in [thread] + thread.get("last_replies", []):
+                    text = clean_comment_body(post["com"]) if post.get("com") else ""
+                    image = IMAGE_URL.format(board, post["tim"], post["ext"]) if "tim" in post and "ext" in post else None
+
+                    if text:
+                        self.texts.append((text, image))
+                    if image:
+                        self.images.append((image, text))
+
+    def random_text(self):
+        """Return random post's text, None if no post has any"""
+
+        return random.choice(self.texts)[0] if self.texts else None
+
+    def random_image(self):
+        """Return random post with image (spoilered) and its text, None if no post has an image"""
+
+        if not self.images:
+            return None
+
+        image, text = random.choice(self.images)
+        return "|| {0} ||\n{1}".format(image, text)
+
+    def random_post(self):
+        """Return random post with text (and its image if it has one), posts without text if there are none"""
+
+        if not self.texts:
+            return self.random_image()
+
+        text, image = random.choice(self.texts)
+        return "|| {0} ||\n{1}".format(image, text) if image else text
+
+
+class ChanCatalogs:
+    """Recently requested boards' catalogs, refreshed with conditional requests once they're older than TTL
+
+    Concurrent requests for the same board share one download.
+    """
+
+    def __init__(self, ttl: float, size: int = 32, interval: float = 1.0):
+        """
+        ttl -- seconds a catalog is used without checking for changes
+        size -- maximum number of cached boards
+        interval -- minimum seconds between requests (4chan API asks for at most one per second)
+        """
+
+        self.ttl = ttl
+        self.size = size
+        self.interval = interval
+
+        # Board -> (time checked, Last-Modified header, catalog), least recently used first
+        self.cache = OrderedDict()
+        # Board -> future of refresh in progress
+        self.pending = dict()
+
+        self.next_request = 0.0
+
+    async def _throttle(self, loop: asyncio.AbstractEventLoop) -> None:
+        now = loop.time()
+        slot = max(now, self.next_request)
+        self.next_request = slot + self.interval
+
+        await asyncio.sleep(slot - now)
+
+    async def _refresh(self, board: str, loop: asyncio.AbstractEventLoop) -> BoardCatalog:
+        cached = self.cache.get(board)
+        conditions = {"If-Modified-Since": cached[1]} if cached is not None and cached[1] else dict()
+
+        await self._throttle(loop)
+
+        try:
+            async with get_http_session().get(CATALOG_URL.format(board), headers=conditions) as response:
+                # Not modified since last check
+                if response.status == 304 and cached is not None:
+                    self.cache[board] = (loop.time(), cached[1], cached[2])
+                    return cached[2]
+
+                if response.status == 404:
+                    raise ChanError("`/{0}/` doesn't exist.".format(board))
+                response.raise_for_status()
+
+                data = await response.read()
+                modified = response.headers.get("Last-Modified")
+
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Stale catalog is better than none
+            if cached is not None:
+                return cached[2]
+            raise ChanError("Couldn't download `/{0}/` catalog.".format(board))
+
+        # Parsing and cleaning up hundreds of posts, don't block the loop
+        catalog = await loop.run_in_executor(None, lambda: BoardCatalog(board, json.loads(data)))
+
+        self.cache[board] = (loop.time(), modified, catalog)
+        self.cache.move_to_end(board)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+        return catalog
+
+    async def get(self, board: str, *, loop=None) -> BoardCatalog:
+        """Return board's catalog, downloaded only if cached one is older than TTL (and changed)"""
+
+        loop = loop or asyncio.get_event_loop()
+        board = board.lower().strip("/")
+
+        cached = self.cache.get(board)
+        if cached is not None and loop.time() - cached[0] < self.ttl:
+            self.cache.move_to_end(board)
+            return cached[2]
+
+        # Same board already being refreshed -> wait for it (shielded, a cancelled waiter doesn't cancel others)
+        if board in self.pending:
+            return await asyncio.shield(self.pending[board])
+
+        request = loop.create_task(self._refresh(board, loop))
+        self.pending[board] = request
+        try:
+            return await asyncio.shield(request)
+        finally:
+            self.pending.pop(board, None)
+
+
+catalogs = ChanCatalogs(ttl=chan_catalog_ttl)
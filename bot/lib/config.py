@@ -21,13 +21,17 @@ YT_PASS = os.getenv("YT_PASS")
 with open("cookies.txt", "w") as text_file:
     print(os.getenv('COOKIE_DATA'), file=text_file)
 
+# Downloaded audio is kept in this directory, least recently played files are deleted over the size limit (bytes)
+audio_cache_dir = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+audio_cache_bytes = int(os.getenv("AUDIO_CACHE_BYTES", str(2 * 1024 ** 3)))
+
 ytdl_format_options = {
     "cookies": "cookies.txt",
     "user_agent": "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0",
     "username": YT_MAIL,
     "password": YT_PASS,
     "format": "bestaudio/best",
-    "outtmpl": "%(extractor)s-%(id)s-%(title)s.%(ext)s",
+    "outtmpl": os.path.join(audio_cache_dir, "%(extractor)s-%(id)s.%(ext)s"),
     "restrictfilenames": True,
     "noplaylist": True,
     "nocheckcertificate": True,
@@ -36,14 +40,47 @@ ytdl_format_options = {
     "quiet": True,
     "no_warnings": True,
     "default_search": "auto",
+    "socket_timeout": 30,
     "source_address": "0.0.0.0"  # Bind to IPv4 since IPv6 addresses cause issues sometimes
 }
 
+# Threads running youtube-dl extractions and downloads, jobs of a single guild running at the same time
+ytdl_workers = int(os.getenv("YTDL_WORKERS", "4"))
+ytdl_guild_jobs = int(os.getenv("YTDL_GUILD_JOBS", "2"))
+
 # -vn discards video stream
 ffmpeg_options = {
     "options": "-vn"
 }
 
+# Playing directly from Youtube's media URL, reconnect if the connection drops
+ffmpeg_stream_options = {
+    "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
+    "options": "-vn"
+}
+
+# Let FFmpeg encode Opus (and apply volume) instead of scaling and encoding PCM frames in Python
+opus_passthrough = os.getenv("OPUS_PASSTHROUGH", "1") == "1"
+# Volume (dB) of tracks with unknown loudness, tracks with known loudness get normalized to target mean volume (dB)
+default_gain = -6.0
+target_loudness = -20.0
+
+# Opus packets (20 ms each) buffered per shared decoder, guilds starting a track within this window share its FFmpeg process
+shared_audio_packets = int(os.getenv("SHARED_AUDIO_PACKETS", "15000"))
+
+# Music sessions without playback or commands for this long (seconds) leave voice and get freed
+session_idle_timeout = float(os.getenv("SESSION_IDLE_TIMEOUT", "600"))
+
+# Music metrics get periodically written here in Prometheus text format (not exported if unset)
+metrics_file = os.getenv("METRICS_FILE")
+
+# Youtube Data API units per day (a search costs 100), seconds search results stay cached
+youtube_daily_quota = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+youtube_search_ttl = 6 * 3600
+
+# Seconds a 4chan board catalog is used before checking it for changes
+chan_catalog_ttl = 60
+
 # Bot's discord activities
 activities = [
     discord.Game(name="with křemík."),
@@ -51,5 +88,20 @@ activities = [
     discord.Activity(type=discord.ActivityType.watching, name="you.")
 ]
 
+# Event loop blocked for longer than this (seconds) gets reported as a stall
+stall_threshold = float(os.getenv("STALL_THRESHOLD", "0.25"))
+
+# SQLite database with Garfield strip index
+strip_index_path = os.getenv("STRIP_INDEX_PATH", "garfield.db")
+# Archive backfill: pages fetched at the same time, requests per second
+strip_backfill_concurrency = int(os.getenv("STRIP_BACKFILL_CONCURRENCY", "4"))
+strip_backfill_rate = float(os.getenv("STRIP_BACKFILL_RATE", "1"))
+
+# SQLite database with Wikipedia "on this day" events
+fact_store_path = os.getenv("FACT_STORE_PATH", "facts.db")
+
+# SQLite database with scraped jokes
+joke_store_path = os.getenv("JOKE_STORE_PATH", "jokes.db")
+
 geckodriver_path = os.getenv("GECKODRIVER_PATH")
 firefox_bin = os.getenv("FIREFOX_BIN")
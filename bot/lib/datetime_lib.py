@@ -29,6 +29,26 @@ def format_date(date: datetime.datetime) -> str:
     return "{0}/{1}/{2}".format(str(date.year), str(date.month).zfill(2), str(date.day).zfill(2))
 
 
+def us_eastern_offset(date: datetime.datetime) -> datetime.timedelta:
+    """Return UTC offset of US Eastern time at a UTC datetime
+
+    Daylight saving time starts on the second Sunday of March and ends on the first Sunday of November,
+    both at 2 AM local time.
+    """
+
+    march = datetime.datetime(date.year, 3, 8)
+    november = datetime.datetime(date.year, 11, 1)
+
+    # Next Sunday (weekday 6) on or after the day, 2 AM local time in UTC
+    dst_start = march + datetime.timedelta(days=(6 - march.weekday()) % 7, hours=7)
+    dst_end = november + datetime.timedelta(days=(6 - november.weekday()) % 7, hours=6)
+
+    if dst_start <= date < dst_end:
+        return datetime.timedelta(hours=-4)
+
+    return datetime.timedelta(hours=-5)
+
+
 def suffix(n: int) -> str:
     """Return number's suffix
 
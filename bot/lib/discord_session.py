@@ -1,20 +1,130 @@
 import asyncio
+import os
+import re
+import subprocess
+import time
+import uuid
+from collections import deque
+from itertools import islice
 
 import discord
 import youtube_dl
 
-from lib.config import ytdl_format_options, ffmpeg_options
+from lib.audio_cache import AudioCache
+from lib.config import ytdl_format_options, ffmpeg_options, ffmpeg_stream_options, audio_cache_dir, audio_cache_bytes
+from lib.config import opus_passthrough, default_gain, target_loudness, shared_audio_packets, ytdl_workers, ytdl_guild_jobs
+from lib.extraction import ExtractionExecutor
+from lib.metrics import music_metrics
+from lib.shared_audio import SharedAudioRegistry
 
 
 youtube_dl.utils.bug_reports_message = lambda: ""
 ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+# Only lists playlist's videos (no metadata of individual videos)
+ytdl_playlist = youtube_dl.YoutubeDL(dict(ytdl_format_options, noplaylist=False, extract_flat="in_playlist"))
+audio_cache = AudioCache(audio_cache_dir, audio_cache_bytes)
+shared_audio = SharedAudioRegistry(shared_audio_packets)
+extraction = ExtractionExecutor(ytdl_workers, ytdl_guild_jobs)
+# Speculative extractions running at the same time
+speculation_slots = asyncio.Semaphore(3)
 
 
-class Player(discord.PCMVolumeTransformer):
+def measure_gain(filename: str):
+    """Return gain (dB) bringing file's mean volume to target loudness without clipping, None if analysis failed"""
+
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-nostats", "-i", filename, "-af", "volumedetect", "-vn", "-sn", "-dn", "-f", "null", "-"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, timeout=120)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    mean = re.search(r"mean_volume: (-?[\d.]+) dB", result.stderr)
+    peak = re.search(r"max_volume: (-?[\d.]+) dB", result.stderr)
+    if not mean or not peak:
+        return None
+
+    return round(min(target_loudness - float(mean.group(1)), -float(peak.group(1))), 1)
+
+
+def audio_source(filename: str, gain: float, stream: bool = False, offset: float = 0.0) -> discord.AudioSource:
+    """FFmpeg audio source with volume applied, starting at offset (seconds)
+
+    In Opus passthrough mode, FFmpeg applies the gain and encodes Opus itself, so packets go to Discord
+    untouched. Otherwise FFmpeg outputs PCM, which gets scaled (and encoded) in Python frame by frame.
+    """
+
+    options = ffmpeg_stream_options if stream else ffmpeg_options
+    before_options = options.get("before_options", "")
+    if offset:
+        before_options += " -ss {0:.2f}".format(offset)
+
+    if opus_passthrough:
+        return discord.FFmpegOpusAudio(filename, before_options=before_options, options=options["options"] + " -af volume={0}dB".format(gain))
+
+    return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(filename, before_options=before_options, options=options["options"]), volume=10 ** (gain / 20))
+
+
+def job_download(job, *, url=None, data=None) -> dict:
+    """Download audio of URL (or of already extracted video info) in an extraction job, return video info
+
+    File is downloaded under a name unique to the job and moved into the cache once complete, so downloads
+    of the same video running at the same time never write into (or resume) the same file. The download
+    aborts once the job gets cancelled.
+    """
+
+    # Matches cache's file pattern, so files of interrupted downloads get cleaned up on the next start
+    outtmpl = os.path.join(audio_cache_dir, "%(extractor)s-%(id)s-" + uuid.uuid4().hex + ".%(ext)s")
+    downloader = youtube_dl.YoutubeDL(dict(ytdl_format_options, outtmpl=outtmpl, progress_hooks=[job.check]))
+
+    if data is None:
+        data = downloader.extract_info(url)
+    else:
+        downloader.process_info(data)
+
+    # Playlist -> only its first item gets played
+    entry = data["entries"][0] if "entries" in data else data
+    os.replace(downloader.prepare_filename(entry), ytdl.prepare_filename(entry))
+
+    return data
+
+
+def downloaded(data: dict, loop: asyncio.AbstractEventLoop, duration: float) -> None:
+    """Add downloaded audio to cache, measure its loudness in the background (once per track)
+
+    duration -- seconds the download (including extraction) took
+    """
+
+    filename = ytdl.prepare_filename(data)
+    audio_cache.add(data, filename)
+
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        size = 0
+    music_metrics.count("download_bytes", size)
+    music_metrics.observe("download_seconds", duration)
+    if duration > 0:
+        music_metrics.observe("download_bytes_per_second", size / duration)
+
+    key = AudioCache.key(data)
+    if audio_cache.gain(key) is None:
+        analysis = loop.run_in_executor(None, measure_gain, filename)
+        analysis.add_done_callback(lambda future: audio_cache.set_gain(key, future.result()))
+
+
+async def extract_playlist(url: str, *, loop=None, guild=None) -> list:
+    """Return URLs of all videos in playlist (single request, videos get resolved once they're played)"""
+
+    data = await extraction.run(lambda job: ytdl_playlist.extract_info(url, download=False), loop=loop, guild=guild)
+
+    return ["https://www.youtube.com/watch?v=" + entry["id"] for entry in data.get("entries", []) if entry and entry.get("id")]
+
+
+class Player(discord.AudioSource):
     """Audio player for Discord"""
 
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
+    def __init__(self, source, *, data, download=None):
+        self.source = source
 
         self.data = data
         self.ytdlData = data
@@ -22,67 +132,322 @@ class Player(discord.PCMVolumeTransformer):
         self.title = data.get("title")
         self.url = data.get("url")
 
+        # Streamed players: task downloading the whole file in the background
+        self.download = download
+        self.streamed = download is not None
+
+        # Audio packets read so far, time the first one was read (time.monotonic)
+        self.packets = 0
+        self.started = None
+
+        # Don't let cache delete the file while it's being played
+        self.cache_key = None
+        if not self.streamed:
+            self.cache_key = AudioCache.key(data)
+            audio_cache.pin(self.cache_key)
+
+    def read(self):
+        packet = self.source.read()
+        if packet:
+            if not self.packets:
+                self.started = time.monotonic()
+            self.packets += 1
+        return packet
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+        if self.cache_key is not None:
+            audio_cache.unpin(self.cache_key)
+            self.cache_key = None
+
+    def local_file(self):
+        """Return path to downloaded audio file, None if it isn't downloaded (yet)"""
+
+        if not self.streamed:
+            return ytdl.prepare_filename(self.data)
+
+        if self.download.done() and not self.download.cancelled() and self.download.exception() is None:
+            return ytdl.prepare_filename(self.download.result())
+
+        return None
+
     @classmethod
     def revive(cls, player):
         """Revives player (essentially rewinds audio file to beginning)"""
 
-        filename = player.ytdlData["url"]
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=player.ytdlData)
+        filename = player.local_file()
+        if filename is None:
+            return cls.from_data(player.ytdlData, stream=True, download=player.download)
 
-    @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        """Downloads audio from Youtube and returns player"""
+        return cls.from_data(player.ytdlData)
+
+    @staticmethod
+    async def extract(url, *, loop=None, stream=False, guild=None, priority=ExtractionExecutor.PLAYBACK) -> dict:
+        """Extract video info from Youtube (and download audio unless streaming)"""
 
         loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
+        start = time.monotonic()
+        if stream:
+            with music_metrics.timer("extraction_seconds"):
+                data = await extraction.run(lambda job: ytdl.extract_info(url, download=False), loop=loop, guild=guild, priority=priority, tag=url)
+        else:
+            data = await extraction.run(lambda job: job_download(job, url=url), loop=loop, guild=guild, priority=priority, tag=url)
 
         if "entries" in data:
             # Take first item from a playlist
             data = data["entries"][0]
 
-        filename = data["url"] if stream else ytdl.prepare_filename(data)
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+        if not stream:
+            downloaded(data, loop, time.monotonic() - start)
+
+        return data
+
+    @staticmethod
+    async def download_extracted(data, *, loop=None, guild=None, priority=ExtractionExecutor.PREFETCH, tag=None) -> dict:
+        """Download audio of already extracted video info (saves extracting it again)"""
+
+        loop = loop or asyncio.get_event_loop()
+        data = dict(data)
+        start = time.monotonic()
+        await extraction.run(lambda job: job_download(job, data=data), loop=loop, guild=guild, priority=priority, tag=tag)
+        downloaded(data, loop, time.monotonic() - start)
+
+        return data
+
+    @classmethod
+    def from_data(cls, data, *, stream=False, download=None):
+        """Create player from extracted video info (volume normalized if track's loudness is known)"""
+
+        gain = audio_cache.gain(AudioCache.key(data))
+        if gain is None:
+            gain = default_gain
+
+        with music_metrics.timer("ffmpeg_spawn_seconds"):
+            if stream:
+                source = audio_source(data["url"], gain, stream=True)
+            # Guilds playing the same file at the same time share one FFmpeg process
+            elif opus_passthrough:
+                filename = ytdl.prepare_filename(data)
+                source = shared_audio.reader(AudioCache.key(data), lambda offset: audio_source(filename, gain, offset=offset))
+            else:
+                source = audio_source(ytdl.prepare_filename(data), gain)
+
+        return cls(source, data=data, download=download if stream else None)
+
+    @classmethod
+    async def resolve(cls, url, *, loop=None, guild=None) -> dict:
+        """Extract video info without downloading, at most a few at a time"""
+
+        async with speculation_slots:
+            return await cls.extract(url, loop=loop, stream=True, guild=guild, priority=ExtractionExecutor.SPECULATIVE)
+
+    @classmethod
+    async def progressive(cls, url, *, loop=None, download=None, info=None, guild=None):
+        """Return player as soon as possible, streaming directly from Youtube while the file downloads
+
+        download -- task already downloading the song (prefetch), started here if None
+        info -- task already extracting video info without downloading (speculative resolution)
+        guild -- guild ID the song plays in (limits its concurrent extractions)
+        """
+
+        loop = loop or asyncio.get_event_loop()
+
+        # Song is needed now -> its jobs still waiting in queue go first
+        extraction.promote(guild, url)
+
+        # Played before -> straight from disk, no extraction needed
+        cached = audio_cache.get(AudioCache.key_from_url(url))
+        if cached is not None:
+            music_metrics.count("audio_cache_hits")
+            for task in (download, info):
+                if task is not None:
+                    task.cancel()
+            return cls.from_data(cached)
+
+        music_metrics.count("audio_cache_misses")
+
+        # Failed prefetch -> try again
+        if download is not None and download.done() and (download.cancelled() or download.exception() is not None):
+            download = None
+
+        # Already downloaded -> play from disk
+        if download is not None and download.done():
+            music_metrics.count("prefetch_hits")
+            if info is not None:
+                info.cancel()
+            return cls.from_data(download.result())
+
+        try:
+            data = None
+
+            # Use info resolved in advance (if it didn't fail)
+            if info is not None and not info.cancelled():
+                try:
+                    data = await info
+                except youtube_dl.utils.DownloadError:
+                    pass
+
+            if data is None:
+                data = await cls.extract(url, loop=loop, stream=True, guild=guild)
+
+        # Direct stream unavailable -> wait for the whole file
+        except youtube_dl.utils.DownloadError:
+            if download is None:
+                download = loop.create_task(cls.extract(url, loop=loop, guild=guild))
+            return cls.from_data(await download)
+
+        if download is None:
+            download = loop.create_task(cls.download_extracted(data, loop=loop, guild=guild, tag=url))
+
+        return cls.from_data(data, stream=True, download=download)
 
 
 class Session:
     """Class representing listening session (tied to guild)"""
 
+    guild_id = None
     vc = None
-    song_queue = []
+    song_queue = None
     song = ""
     repeat = False
-
-    def __init__(self):
+    prefetched = None
+    resolved = None
+    task = None
+    channel = None
+    finished = None
+    last_active = None
+
+    def __init__(self, guild_id=None):
+        self.guild_id = guild_id
         self.vc = None
-        self.song_queue = []
+
+        # Queued song URLs, resolved (downloaded) only just before they're needed
+        self.song_queue = deque()
         self.song = ""
         self.repeat = False
 
+        # Queued song URL -> task downloading it in the background
+        self.prefetched = dict()
+        # Song URL -> task extracting its info while user is still choosing it
+        self.resolved = dict()
+
+        # Task playing the queue, text channel it reports to
+        self.task = None
+        self.channel = None
+
+        # Set by voice client when current song stops playing
+        self.finished = asyncio.Event()
+
+        # Time of last command or song change (time.monotonic)
+        self.last_active = time.monotonic()
+
+    def touch(self) -> None:
+        """Mark session as active"""
+
+        self.last_active = time.monotonic()
+
+    def idle_time(self) -> float:
+        """Seconds since last activity, zero while something is playing"""
+
+        if self.vc is not None and self.vc.is_playing():
+            return 0.0
+
+        return time.monotonic() - self.last_active
+
     def reset(self) -> None:
         """Restart session (clearing all variables)"""
         self.vc = None
-        self.song_queue = []
+        self.song_queue.clear()
         self.song = ""
         self.repeat = False
+        self.cancel_prefetch()
+
+    def prefetch(self, loop: asyncio.AbstractEventLoop, depth: int = 2) -> None:
+        """Download next `depth` queued songs in the background, cancel downloads of songs no longer up next"""
+
+        upcoming = list(islice(self.song_queue, depth))
+
+        for url in list(self.prefetched):
+            if url not in upcoming:
+                self.prefetched.pop(url).cancel()
+
+        for url in upcoming:
+            # Cached songs don't need downloading
+            if url not in self.prefetched and audio_cache.get(AudioCache.key_from_url(url)) is None:
+                self.prefetched[url] = loop.create_task(Player.extract(url, loop=loop, guild=self.guild_id, priority=ExtractionExecutor.PREFETCH))
+
+    def speculate(self, url: str, loop: asyncio.AbstractEventLoop) -> asyncio.Task:
+        """Start resolving song which may get queued, return its task"""
+
+        task = loop.create_task(Player.resolve(url, loop=loop, guild=self.guild_id))
+        self.resolved[url] = task
+
+        def forget(finished: asyncio.Task) -> None:
+            """Forget task once discarded"""
+            if finished.cancelled() and self.resolved.get(url) is finished:
+                del self.resolved[url]
+
+        task.add_done_callback(forget)
+
+        return task
+
+    def take_resolved(self, url: str):
+        """Return task resolving song in advance, None if there is none"""
+
+        return self.resolved.pop(url, None)
+
+    def take_prefetched(self, url: str):
+        """Return task downloading song in the background, None if it isn't being prefetched"""
+
+        return self.prefetched.pop(url, None)
+
+    def cancel_prefetch(self) -> None:
+        """Cancel all background downloads"""
+
+        for task in list(self.prefetched.values()) + list(self.resolved.values()):
+            task.cancel()
+        self.prefetched.clear()
+        self.resolved.clear()
+
+    def clear(self) -> None:
+        """Empty queue"""
+
+        self.song_queue.clear()
+        self.cancel_prefetch()
 
     def forceplay(self, song: str) -> None:
         """Add song to the front of queue"""
 
-        self.song_queue.insert(0, song)
+        self.song_queue.appendleft(song)
+
+    def enqueue(self, songs: list, front: bool = False) -> None:
+        """Add songs to the back (or front, keeping their order) of queue"""
+
+        if front:
+            self.song_queue.extendleft(reversed(songs))
+        else:
+            self.song_queue.extend(songs)
 
     def queue_empty(self) -> bool:
         return len(self.song_queue) == 0
 
-    def queue_to_string(self) -> str:
-        """Return queued songs as a long string"""
+    def queue_to_string(self, limit: int = 25) -> str:
+        """Return first `limit` queued songs as a long string"""
 
         if self.queue_empty():
             return "Queue is empty."
 
         queue = "🎶 Queue 🎶: "
-        for queued_song in self.song_queue:
+        for queued_song in islice(self.song_queue, limit):
             queue += queued_song + "\n"
 
+        if len(self.song_queue) > limit:
+            queue += "...and {0} more".format(len(self.song_queue) - limit)
+
         return queue
 
     def next_song(self) -> bool:
@@ -114,7 +479,7 @@ class Session:
 
         try:
             self.vc.stop()
-            self.song_queue = []
+            self.clear()
             self.song = ""
             self.repeat = False
 
@@ -123,6 +488,15 @@ class Session:
 
         return True
 
+    async def play(self, player: Player, loop: asyncio.AbstractEventLoop) -> None:
+        """Play audio and wait until it finishes, is skipped or bot leaves voice"""
+
+        self.finished.clear()
+
+        # Voice client calls 'after' from its own thread
+        self.vc.play(player, after=lambda error: loop.call_soon_threadsafe(self.finished.set))
+        await self.finished.wait()
+
     def is_paused(self) -> bool:
         """Returns True if connected and paused, False otherwise"""
 
@@ -133,6 +507,21 @@ class Session:
 
         self.vc.resume()
 
+    async def close(self) -> None:
+        """Stop playing, leave voice and drop queue (including background downloads)"""
+
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        if self.vc is not None:
+            self.vc.stop()
+            if self.vc.is_connected():
+                await self.vc.disconnect()
+
+        self.reset()
+        self.channel = None
+
     async def connect(self, channel: discord.VoiceChannel) -> None:
         """Connect or move to voice channel"""
 
@@ -143,3 +532,56 @@ class Session:
         # If connected to one, move to user's channel (can match current -> does nothing)
         else:
             await self.vc.move_to(channel)
+
+
+class SessionRegistry:
+    """Listening sessions of guilds, created on first use and closed after being idle for a while"""
+
+    def __init__(self, idle_timeout: float):
+        """
+        idle_timeout -- seconds without playback or commands after which session gets closed
+        """
+
+        self.idle_timeout = idle_timeout
+
+        # Guild ID -> session
+        self.sessions = dict()
+
+    def get(self, guild_id: int) -> Session:
+        """Return guild's session (creating it if needed) and mark it as active"""
+
+        session = self.sessions.get(guild_id)
+        if session is None:
+            session = Session(guild_id)
+            self.sessions[guild_id] = session
+
+        session.touch()
+
+        return session
+
+    async def close_idle(self) -> None:
+        """Close and forget sessions idle for longer than the timeout"""
+
+        for guild_id, session in list(self.sessions.items()):
+            if session.idle_time() > self.idle_timeout:
+                del self.sessions[guild_id]
+                await session.close()
+
+    def queued(self) -> int:
+        """Number of songs queued in all guilds"""
+
+        return sum(len(session.song_queue) for session in self.sessions.values())
+
+    async def close_all(self) -> None:
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+
+        for session in sessions:
+            await session.close()
+
+    async def run(self, interval: float = 60) -> None:
+        """Keep closing idle sessions"""
+
+        while True:
+            await asyncio.sleep(interval)
+            await self.close_idle()
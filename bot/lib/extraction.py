@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """Function waiting for (or running in) extraction executor"""
+
+    def __init__(self, fn, guild, priority: int, tag, sequence: int):
+        self.fn = fn
+        self.guild = guild
+        self.priority = priority
+        self.tag = tag
+        self.sequence = sequence
+
+        # Counted towards guild's limit of running prefetches
+        self.limited = False
+
+        self.future = Future()
+        self.cancelled = threading.Event()
+
+    def check(self, *_) -> None:
+        """Raise JobCancelled if job was abandoned (usable as youtube-dl progress hook)"""
+
+        if self.cancelled.is_set():
+            raise JobCancelled
+
+
+class ExtractionExecutor:
+    """Dedicated worker threads for youtube-dl extraction and downloads
+
+    Jobs run in order of priority (then submission), each guild runs at most `per_guild` prefetches at once
+    (playback and speculative jobs aren't limited, and prefetches always leave one worker free for them, so
+    they never wait behind prefetches) and abandoned jobs
+    are cancelled - queued ones never start, running ones stop at their next progress hook.
+    """
+
+    # Priorities, lower runs first
+    PLAYBACK = 0
+    SPECULATIVE = 1
+    PREFETCH = 2
+
+    def __init__(self, workers: int, per_guild: int):
+        self.per_guild = per_guild
+        # Prefetches running at the same time (in all guilds)
+        self.prefetch_workers = max(1, workers - 1)
+
+        self.queue = []
+        self.running = Counter()
+        self.condition = threading.Condition()
+        self._sequence = itertools.count()
+
+        for i in range(workers):
+            threading.Thread(target=self._work, name="extraction-{0}".format(i), daemon=True).start()
+
+    def _next_job(self) -> Job:
+        """Take highest priority job, skipping prefetches of guilds at their limit (call with condition held)"""
+
+        while True:
+            prefetch_free = sum(self.running.values()) < self.prefetch_workers
+            eligible = [job for job in self.queue if job.priority < self.PREFETCH or (prefetch_free and self.running[job.guild] < self.per_guild)]
+            if eligible:
+                job = min(eligible, key=lambda j: (j.priority, j.sequence))
+                self.queue.remove(job)
+                job.limited = job.priority == self.PREFETCH
+                if job.limited:
+                    self.running[job.guild] += 1
+                return job
+
+            self.condition.wait()
+
+    def _work(self) -> None:
+        while True:
+            with self.condition:
+                job = self._next_job()
+
+            try:
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                job.future.set_result(job.fn(job))
+            except BaseException as e:
+                job.future.set_exception(e)
+            finally:
+                with self.condition:
+                    if job.limited:
+                        self.running[job.guild] -= 1
+                        if self.running[job.guild] <= 0:
+                            del self.running[job.guild]
+                    self.condition.notify_all()
+
+    def submit(self, fn, *, guild=None, priority: int = PLAYBACK, tag=None) -> Job:
+        """Queue fn(job) to run in a worker thread"""
+
+        job = Job(fn, guild, priority, tag, next(self._sequence))
+
+        with self.condition:
+            self.queue.append(job)
+            self.condition.notify_all()
+
+        return job
+
+    def cancel(self, job: Job) -> None:
+        """Drop queued job, signal running job to stop"""
+
+        job.cancelled.set()
+
+        with self.condition:
+            if job in self.queue:
+                self.queue.remove(job)
+                job.future.cancel()
+
+    def promote(self, guild, tag, priority: int = PLAYBACK) -> None:
+        """Raise priority of guild's queued jobs with tag (for example prefetch which is now needed)"""
+
+        with self.condition:
+            for job in self.queue:
+                if job.guild == guild and job.tag == tag:
+                    job.priority = min(job.priority, priority)
+
+    async def run(self, fn, *, loop=None, guild=None, priority: int = PLAYBACK, tag=None):
+        """Run fn(job) in executor and return its result, cancelling the job if the awaiting task is cancelled"""
+
+        loop = loop or asyncio.get_event_loop()
+        job = self.submit(fn, guild=guild, priority=priority, tag=tag)
+
+        try:
+            return await asyncio.wrap_future(job.future, loop=loop)
+        except asyncio.CancelledError:
+            self.cancel(job)
+            raise
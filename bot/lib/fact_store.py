@@ -0,0 +1,259 @@
+import asyncio
+import datetime
+import random
+import re
+import sqlite3
+
+import numpy as np
+
+from lib.http_session import get_http_session
+
+
+# Raw wikitext of a page
+RAW_URL = "https://en.wikipedia.org/w/index.php?title={0}&action=raw"
+
+COMMENT = re.compile(r"<!--.*?-->", re.S)
+REFERENCE = re.compile(r"<ref[^>]*/>|<ref[^>]*>.*?</ref>", re.S)
+TEMPLATE = re.compile(r"\{\{[^{}]*\}\}")
+# Dash templates separating year from text ('1978 {{snd}} Text')
+DASH_TEMPLATE = re.compile(r"\{\{\s*(?:snd|spnd|sndash|spaced ndash|spaced en dash|ndash)\s*\}\}", re.I)
+LINK = re.compile(r"\[\[(?:[^|\]]*\|)?([^\]]*)\]\]")
+EXTERNAL_LINK = re.compile(r"\[https?://\S+ ([^\]]*)\]")
+TAG = re.compile(r"<[^>]+>")
+EVENTS = re.compile(r"^==\s*Events\s*==\s*$(.*?)(?=^==[^=]|\Z)", re.M | re.S)
+# '1978 – Text', 'AD 69 – Text', '480 BC – Text'
+EVENT = re.compile(r"^(?:AD\s*)?(\d{1,4})(\s*BC)?\s*(?:–|—|-|&ndash;|&mdash;)\s*(.+)$")
+# Year heading of nested events ('1905:')
+YEAR = re.compile(r"^(?:AD\s*)?(\d{1,4})(\s*BC)?\s*:?$")
+
+
+def page_title(month: int, day: int) -> str:
+    return datetime.date(2000, month, day).strftime("%B") + "_" + str(day)
+
+
+def plain_text(wikitext: str) -> str:
+    """Strip wiki markup from a line"""
+
+    text = LINK.sub(r"\1", wikitext)
+    text = EXTERNAL_LINK.sub(r"\1", text)
+    text = TAG.sub("", text).replace("'''", "").replace("''", "").replace("&nbsp;", " ")
+
+    return " ".join(text.split())
+
+
+def parse_year(match) -> int:
+    """Year from regex match (BC years are negative)"""
+
+    return -int(match.group(1)) if match.group(2) else int(match.group(1))
+
+
+def parse_events(wikitext: str) -> list:
+    """Parse 'Events' section of a day's page into (year, text) pairs"""
+
+    section = EVENTS.search(wikitext)
+    if section is None:
+        return []
+
+    text = REFERENCE.sub("", COMMENT.sub("", section.group(1)))
+    text = DASH_TEMPLATE.sub(" – ", text)
+
+    # Remove (other) templates (innermost first, they can be nested)
+    while True:
+        text, count = TEMPLATE.subn("", text)
+        if not count:
+            break
+
+    events = []
+    year = None
+
+    for line in text.splitlines():
+        depth = len(line) - len(line.lstrip("*"))
+        content = plain_text(line[depth:])
+        if not depth or not content:
+            continue
+
+        if depth == 1:
+            event = EVENT.match(content)
+            if event:
+                events.append((parse_year(event), event.group(3)))
+                year = None
+                continue
+
+            heading = YEAR.match(content)
+            year = parse_year(heading) if heading else None
+
+        # Nested under a year heading
+        elif year is not None:
+            events.append((year, content))
+
+    return events
+
+
+def format_fact(year: int, text: str) -> str:
+    return "{0} BC – {1}".format(-year, text) if year < 0 else "{0} – {1}".format(year, text)
+
+
+def day_of_year(month: int, day: int) -> int:
+    """Index of day in a leap year (0 - 365)"""
+
+    return datetime.date(2000, month, day).timetuple().tm_yday - 1
+
+
+class FactIndex:
+    """Facts of all days in compact parallel arrays, sorted by day of year and then by year
+
+    Texts are stored UTF-8 encoded in a single bytes object, facts of a day form a contiguous range, so
+    facts of a day from a range of years are found with a binary search.
+    """
+
+    def __init__(self, records: list):
+        """
+        records -- (month, day, year, text) tuples
+        """
+
+        records = sorted((day_of_year(month, day), year, text) for month, day, year, text in records)
+
+        # Day of year -> index of its first fact (day_offsets[366] == number of facts)
+        days = np.array([day for day, _, _ in records], dtype=np.int16)
+        self.day_offsets = np.searchsorted(days, np.arange(367)).astype(np.int32)
+
+        self.years = np.array([year for _, year, _ in records], dtype=np.int16)
+
+        encoded = [text.encode() for _, _, text in records]
+        self.text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=self.text_offsets[1:])
+        self.texts = b"".join(encoded)
+
+    def __len__(self) -> int:
+        return len(self.years)
+
+    def count(self, month: int, day: int) -> int:
+        """Number of facts about day"""
+
+        index = day_of_year(month, day)
+        return int(self.day_offsets[index + 1] - self.day_offsets[index])
+
+    def event(self, i: int) -> tuple:
+        """Return (year, text) of i-th fact"""
+
+        return int(self.years[i]), self.texts[self.text_offsets[i]:self.text_offsets[i + 1]].decode()
+
+    def random_event(self, month: int, day: int, first_year: int = None, last_year: int = None):
+        """Return random (year, text) about day from years between first and last year (inclusive), None if there is none"""
+
+        index = day_of_year(month, day)
+        start, end = int(self.day_offsets[index]), int(self.day_offsets[index + 1])
+
+        # Years of a day are sorted
+        years = self.years[start:end]
+        low = start + (int(np.searchsorted(years, first_year, side="left")) if first_year is not None else 0)
+        high = start + (int(np.searchsorted(years, last_year, side="right")) if last_year is not None else end - start)
+
+        if low >= high:
+            return None
+
+        return self.event(random.randrange(low, high))
+
+
+class FactStore:
+    """Events of all 366 'on this day' Wikipedia pages, parsed once and kept locally
+
+    Pages are refreshed in the background with conditional requests, so unchanged pages aren't downloaded again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS facts (month INTEGER, day INTEGER, year INTEGER, text TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS facts_day ON facts (month, day)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages (month INTEGER, day INTEGER, etag TEXT, modified TEXT, PRIMARY KEY (month, day))")
+        self.connection.commit()
+
+        self.index = None
+        self.load_index()
+
+    def random_fact(self, month: int, day: int, years: list = ()):
+        """Return random fact about day formatted as 'YEAR – text', None if no facts are stored for it
+
+        years -- (first, last) year ranges tried in order before falling back to any year
+        """
+
+        for first_year, last_year in list(years) + [(None, None)]:
+            event = self.index.random_event(month, day, first_year, last_year)
+            if event is not None:
+                return format_fact(*event)
+
+        return None
+
+    def store(self, month: int, day: int, events: list, etag, modified) -> None:
+        """Replace day's facts (in database, in memory once the index gets rebuilt)"""
+
+        with self.connection:
+            self.connection.execute("DELETE FROM facts WHERE month = ? AND day = ?", (month, day))
+            self.connection.executemany("INSERT INTO facts (month, day, year, text) VALUES (?, ?, ?, ?)",
+                                        [(month, day, year, text) for year, text in events])
+            self.connection.execute("INSERT OR REPLACE INTO pages (month, day, etag, modified) VALUES (?, ?, ?, ?)", (month, day, etag, modified))
+
+    async def refresh_day(self, month: int, day: int, *, loop=None) -> bool:
+        """Download day's page unless it didn't change, return True if facts were updated"""
+
+        loop = loop or asyncio.get_event_loop()
+
+        validators = self.connection.execute("SELECT etag, modified FROM pages WHERE month = ? AND day = ?", (month, day)).fetchone()
+        conditions = dict()
+        if validators is not None and self.index.count(month, day):
+            if validators[0]:
+                conditions["If-None-Match"] = validators[0]
+            if validators[1]:
+                conditions["If-Modified-Since"] = validators[1]
+
+        async with get_http_session().get(RAW_URL.format(page_title(month, day)), headers=conditions) as response:
+            if response.status == 304:
+                return False
+            response.raise_for_status()
+            wikitext = await response.text()
+            etag = response.headers.get("ETag")
+            modified = response.headers.get("Last-Modified")
+
+        # Regular expressions over a long page, don't block the loop
+        events = await loop.run_in_executor(None, parse_events, wikitext)
+        if not events:
+            return False
+
+        self.store(month, day, events, etag, modified)
+
+        return True
+
+    async def refresh(self, *, loop=None, concurrency: int = 4) -> None:
+        """Refresh all 366 days, a few at a time"""
+
+        loop = loop or asyncio.get_event_loop()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def refresh_day(date: datetime.date) -> bool:
+            async with slots:
+                return await self.refresh_day(date.month, date.day, loop=loop)
+
+        # Leap year, to include February 29th
+        days = [datetime.date(2000, 1, 1) + datetime.timedelta(days=i) for i in range(366)]
+        # Day failing (download, decoding, parsing) is retried on the next refresh, doesn't stop the others
+        updated = await asyncio.gather(*(refresh_day(date) for date in days), return_exceptions=True)
+
+        if any(result is True for result in updated):
+            await loop.run_in_executor(None, self.load_index)
+
+    def load_index(self) -> None:
+        """Rebuild index from database (with its own connection, usable from another thread)"""
+
+        connection = sqlite3.connect(self.path)
+        try:
+            self.index = FactIndex(connection.execute("SELECT month, day, year, text FROM facts").fetchall())
+        finally:
+            connection.close()
+
+    async def run(self, *, loop=None, interval: float = 7 * 86400) -> None:
+        """Keep facts up to date"""
+
+        while True:
+            await self.refresh(loop=loop)
+            await asyncio.sleep(interval)
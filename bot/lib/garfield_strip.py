@@ -1,10 +1,18 @@
+import asyncio
 import datetime
 
-import requests
+import aiohttp
 from bs4 import BeautifulSoup
 
-from lib.config import headers
-from lib.datetime_lib import format_date
+from lib.config import strip_index_path
+from lib.datetime_lib import format_date, us_eastern_offset
+from lib.http_session import get_http_session
+from lib.strip_index import StripIndex
+
+
+strip_index = StripIndex(strip_index_path)
+# New strips come out at 01:07 US Eastern time
+RELEASE_TIME = datetime.time(1, 7)
 
 
 class GarfieldError(Exception):
@@ -15,17 +23,106 @@ class GarfieldError(Exception):
         return self.message
 
 
+class GarfieldConnectionError(GarfieldError):
+    """Gocomics unreachable, overloaded or refusing requests (trying again later may help)"""
+    pass
+
+
 def valid_date(date: datetime.datetime) -> int:
     """Checks if a Garfield strip came out on a specified date"""
-    if date > datetime.datetime.today():
+    if date > latest_release(datetime.datetime.utcnow()):
         return 1
     if date < datetime.datetime(1978, 6, 19):
         return -1
     return 0
 
 
-def garfield_strip(date: datetime.datetime) -> str:
-    """Return link to Garfield comic strip for a given date"""
+def eastern_date(now: datetime.datetime) -> datetime.datetime:
+    """Return current date (midnight) in US Eastern time
+
+    now -- current UTC time
+    """
+
+    return datetime.datetime.combine((now + us_eastern_offset(now)).date(), datetime.time.min)
+
+
+def release_time(date: datetime.datetime) -> datetime.datetime:
+    """Return UTC time when strip of (US Eastern) date comes out"""
+
+    local = datetime.datetime.combine(date.date(), RELEASE_TIME)
+
+    # DST changes at 2 AM, so offset of standard time at release time is correct
+    return local - us_eastern_offset(local + datetime.timedelta(hours=5))
+
+
+def latest_release(now: datetime.datetime) -> datetime.datetime:
+    """Return date (midnight) of the newest released strip
+
+    now -- current UTC time
+    """
+
+    date = eastern_date(now)
+    if now < release_time(date):
+        date -= datetime.timedelta(days=1)
+
+    return date
+
+
+def strip_url(date: datetime.datetime) -> str:
+    """URL of gocomics page with strip released on date"""
+
+    return "http://www.gocomics.com/garfield/" + format_date(date)
+
+
+def find_strip(page: bytes):
+    """Return comic image URL found in gocomics page, None if there isn't one"""
+
+    soup = BeautifulSoup(page, "html.parser")
+    picture = soup.find_all("picture", attrs={"class": "item-comic-image"})
+
+    if not picture or not picture[0] or not picture[0].img:
+        return None
+
+    return picture[0].img["src"]
+
+
+async def scrape_strip(date: datetime.datetime, *, loop=None) -> str:
+    """Scrape link to Garfield comic strip from gocomics and index it"""
+
+    loop = loop or asyncio.get_event_loop()
+    url = strip_url(date)
+
+    # Page of an unreleased strip can show an older one, which mustn't get indexed under this date
+    if date > latest_release(datetime.datetime.utcnow()):
+        raise GarfieldError("Garfield comic from {0} isn't out yet".format(format_date(date)))
+
+    try:
+        async with get_http_session().get(url) as response:
+            # No page for the date -> there's no strip
+            if response.status == 404:
+                raise GarfieldError("Garfield comic not found on " + url)
+            # Anything else (rate limiting, bot protection, server errors) may work later
+            if response.status != 200:
+                raise GarfieldConnectionError("Bad response (status code {0}) from {1})".format(response.status, url))
+            page = await response.read()
+
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        raise GarfieldConnectionError("Couldn't connect to " + url)
+
+    # Parsing the whole page takes a while, don't block the event loop
+    comic = await loop.run_in_executor(None, find_strip, page)
+
+    # If strip missing (page of an unreleased strip can show the previous one)
+    if comic is None or comic == strip_index.get(date - datetime.timedelta(days=1)):
+        raise GarfieldError("Garfield comic not found on " + url)
+
+    strip_index.add(date, comic)
+
+    return comic
+
+
+async def garfield_strip(date: datetime.datetime, *, loop=None) -> str:
+    """Return link to Garfield comic strip for a given date (scraped only if it isn't indexed yet)"""
 
     # Check date
     if valid_date(date) > 0:
@@ -33,23 +130,43 @@ def garfield_strip(date: datetime.datetime) -> str:
     elif valid_date(date) < 0:
         raise GarfieldError("Unfortunately, Garfield didn't exist before 19th June 1978.")
 
-    # Construct URL using date
-    url = "http://www.gocomics.com/garfield/" + format_date(date)
+    comic = strip_index.get(date)
+    if comic is not None:
+        return comic
 
-    try:
-        response = requests.get(url, headers)
-        response.raise_for_status()
+    return await scrape_strip(date, loop=loop)
 
-    except requests.HTTPError:
-        raise GarfieldError("Bad response (status code {0}) from {1})".format(response.status_code, url))
 
-    # Scrape page for comic
-    soup = BeautifulSoup(response.content, "html.parser")
-    picture = soup.find_all("picture", attrs={"class": "item-comic-image"})
+async def wait_for_strip(date: datetime.datetime, *, loop=None, interval: float = 15, timeout: float = 3 * 3600):
+    """Poll gocomics until strip of date comes out, return its link (None if it didn't come out in time)"""
 
-    # If strip missing
-    if not picture or not picture[0]:
-        raise GarfieldError("Garfield comic not found on " + url)
+    loop = loop or asyncio.get_event_loop()
+    deadline = loop.time() + timeout
 
-    # Else return comic strip
-    return picture[0].img["src"]
+    while loop.time() < deadline:
+        comic = strip_index.get(date)
+        if comic is not None:
+            return comic
+
+        try:
+            return await scrape_strip(date, loop=loop)
+        except GarfieldError:
+            await asyncio.sleep(interval)
+
+    return None
+
+
+async def garfield_strips(dates: list, *, loop=None, concurrency: int = 4) -> list:
+    """Return links to strips of all dates (GarfieldError instead of the link if it failed), scraping a few at a time"""
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def strip(date: datetime.datetime):
+        # Indexed strips don't wait for a slot
+        if strip_index.get(date) is not None:
+            return strip_index.get(date)
+
+        async with slots:
+            return await garfield_strip(date, loop=loop)
+
+    return await asyncio.gather(*(strip(date) for date in dates), return_exceptions=True)
@@ -0,0 +1,16 @@
+import aiohttp
+
+from lib.config import headers
+
+
+# Shared HTTP session (created on first use, it has to be created inside the event loop)
+http_session = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    global http_session
+
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(headers={"User-Agent": headers["User-Agent"]}, timeout=aiohttp.ClientTimeout(total=30))
+
+    return http_session
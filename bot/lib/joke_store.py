@@ -0,0 +1,106 @@
+import asyncio
+import random
+import sqlite3
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+from lib.http_session import get_http_session
+
+
+JOKE_URL = "http://stupidstuff.org/jokes/joke.htm?jokeid={0}"
+# Jokes have IDs 1 - 3773
+JOKE_COUNT = 3773
+
+
+def find_joke(page: bytes):
+    """Return normalized joke text found in page (empty lines removed), None if there is no joke"""
+
+    soup = BeautifulSoup(page, "html.parser")
+    table = soup.find("table", attrs={"class": "scroll"})
+    if not table:
+        return None
+
+    lines = []
+    for row in table.findAll("tr"):
+        lines += [line.strip() for line in str(row.text).splitlines() if line.strip()]
+
+    return "\n".join(lines) if lines else None
+
+
+class JokeStore:
+    """Local copy of all stupidstuff.org jokes
+
+    Built once in the background (continuing where it stopped after a restart). IDs without a joke are
+    remembered, so they're never scraped (or shown) again.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jokes (id INTEGER PRIMARY KEY, text TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS failed (id INTEGER PRIMARY KEY)")
+        self.connection.commit()
+
+        # IDs of stored jokes (for picking a random one), IDs without a joke
+        self.ids = [joke_id for joke_id, in self.connection.execute("SELECT id FROM jokes")]
+        self.failed = {joke_id for joke_id, in self.connection.execute("SELECT id FROM failed")}
+
+    def random_joke(self):
+        """Return random stored joke, None if none are stored yet"""
+
+        if not self.ids:
+            return None
+
+        return self.connection.execute("SELECT text FROM jokes WHERE id = ?", (random.choice(self.ids),)).fetchone()[0]
+
+    def missing(self) -> list:
+        """IDs neither stored nor known to have no joke"""
+
+        known = set(self.ids) | self.failed
+        return [joke_id for joke_id in range(1, JOKE_COUNT + 1) if joke_id not in known]
+
+    async def fetch(self, joke_id: int, *, loop=None):
+        """Scrape joke and store it, return its text (None if there is no joke with the ID)
+
+        Raises aiohttp.ClientError (or asyncio.TimeoutError) if the page couldn't be downloaded.
+        """
+
+        loop = loop or asyncio.get_event_loop()
+
+        async with get_http_session().get(JOKE_URL.format(joke_id)) as response:
+            if response.status == 404:
+                page = None
+            else:
+                response.raise_for_status()
+                page = await response.read()
+
+        # Parsing the whole page takes a while, don't block the event loop
+        text = await loop.run_in_executor(None, find_joke, page) if page is not None else None
+
+        with self.connection:
+            if text is None:
+                self.connection.execute("INSERT OR IGNORE INTO failed (id) VALUES (?)", (joke_id,))
+                self.failed.add(joke_id)
+            else:
+                self.connection.execute("INSERT OR REPLACE INTO jokes (id, text) VALUES (?, ?)", (joke_id, text))
+                if joke_id not in self.ids:
+                    self.ids.append(joke_id)
+
+        return text
+
+    async def build(self, *, loop=None, concurrency: int = 4, delay: float = 0.5) -> None:
+        """Scrape all missing jokes, `concurrency` at a time (pages failing to download are retried on the next build)"""
+
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch(joke_id: int):
+            async with slots:
+                try:
+                    await self.fetch(joke_id, loop=loop)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+
+                # Don't hammer the site
+                await asyncio.sleep(delay)
+
+        await asyncio.gather(*(fetch(joke_id) for joke_id in self.missing()))
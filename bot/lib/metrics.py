@@ -0,0 +1,144 @@
+import asyncio
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+
+class Summary:
+    """Count, sum and maximum of observed values, quantiles of the most recent ones"""
+
+    def __init__(self, window: int = 256):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.maximum = max(self.maximum, value)
+        self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Metrics:
+    """Counters, gauges and value summaries (timings in seconds), safe to update from any thread"""
+
+    QUANTILES = (0.5, 0.95)
+
+    def __init__(self, prefix: str):
+        """
+        prefix -- prepended to metric names in Prometheus export
+        """
+
+        self.prefix = prefix
+
+        self.counters = Counter()
+        self.gauges = dict()
+        self.summaries = dict()
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            if name not in self.summaries:
+                self.summaries[name] = Summary()
+            self.summaries[name].observe(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Observe duration (seconds) of the block, only if it doesn't raise"""
+
+        start = time.monotonic()
+        yield
+        self.observe(name, time.monotonic() - start)
+
+    def ratio(self, hits: str, misses: str):
+        """Share of hits among hits and misses, None if there were neither"""
+
+        total = self.counters[hits] + self.counters[misses]
+        return self.counters[hits] / total if total else None
+
+    def report(self) -> str:
+        """Metrics as a human readable string"""
+
+        with self.lock:
+            lines = []
+
+            for name, summary in sorted(self.summaries.items()):
+                lines.append("`{0}` - {1}x, mean `{2:.3f}`, p50 `{3:.3f}`, p95 `{4:.3f}`, max `{5:.3f}`".format(
+                    name, summary.count, summary.mean, summary.quantile(0.5), summary.quantile(0.95), summary.maximum))
+
+            for name, value in sorted(self.counters.items()):
+                lines.append("`{0}` - {1:g}".format(name, value))
+
+            for name, value in sorted(self.gauges.items()):
+                lines.append("`{0}` - {1:g} (now)".format(name, value))
+
+        return "\n".join(lines) if lines else "Nothing measured yet."
+
+    def prometheus(self) -> str:
+        """Metrics in Prometheus text exposition format"""
+
+        lines = []
+
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                metric = self.prefix + name + "_total"
+                lines += ["# TYPE {0} counter".format(metric), "{0} {1:g}".format(metric, value)]
+
+            for name, value in sorted(self.gauges.items()):
+                metric = self.prefix + name
+                lines += ["# TYPE {0} gauge".format(metric), "{0} {1:g}".format(metric, value)]
+
+            for name, summary in sorted(self.summaries.items()):
+                metric = self.prefix + name
+                lines.append("# TYPE {0} summary".format(metric))
+                for q in self.QUANTILES:
+                    lines.append('{0}{{quantile="{1}"}} {2:g}'.format(metric, q, summary.quantile(q)))
+                lines += ["{0}_sum {1:g}".format(metric, summary.total), "{0}_count {1}".format(metric, summary.count)]
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Write Prometheus export (atomically, so a scraper never reads half a file)"""
+
+        with open(path + ".tmp", "w") as file:
+            file.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+    async def export(self, path: str, *, loop=None, interval: float = 15) -> None:
+        """Keep rewriting Prometheus export file (for node exporter's textfile collector or similar)"""
+
+        loop = loop or asyncio.get_event_loop()
+
+        while True:
+            try:
+                await loop.run_in_executor(None, self.write, path)
+            except OSError:
+                pass
+
+            await asyncio.sleep(interval)
+
+
+# Music pipeline (search, extraction, download, playback)
+music_metrics = Metrics("pepek_music_")
@@ -0,0 +1,119 @@
+import asyncio
+from collections import OrderedDict, deque
+
+from lib.minesweeper import Minesweeper, MinesweeperError
+
+
+def render_minefield(bombs: int, width: int, height: int, no_guess: bool) -> list:
+    """Generate a minefield and return it rendered as Discord messages"""
+
+    return Minesweeper(width=width, height=height, bombs=bombs, no_guess=no_guess).to_messages(spoiler=True)
+
+
+class MinefieldPool:
+    """Bounded pool of ready-rendered minefields, refilled in the background
+
+    Configurations are tuples (bombs, width, height, no_guess). The default configuration is always kept,
+    other configurations start being kept once they were generated on demand quickly (on a small board),
+    and stay while they are among the most recently requested ones.
+    """
+
+    def __init__(self, default: tuple = (25, 10, 10, False), size: int = 5, tracked: int = 8,
+                 max_tiles: int = 900, max_seconds: float = 0.5):
+        """
+        default -- configuration which is never evicted
+        size -- ready fields kept per configuration
+        tracked -- maximum number of configurations kept (including the default one)
+        max_tiles -- largest board (width * height) worth keeping ready
+        max_seconds -- longest on-demand generation of a configuration worth keeping ready
+        """
+
+        self.default = default
+        self.size = size
+        self.tracked = tracked
+        self.max_tiles = max_tiles
+        self.max_seconds = max_seconds
+
+        # Configuration -> ready fields, ordered from least to most recently requested
+        self.fields = OrderedDict()
+        self.fields[default] = deque(maxlen=size)
+
+        self._wanted = asyncio.Event()
+        self._wanted.set()
+
+    def take(self, config: tuple):
+        """Return ready-rendered field for configuration, None if there isn't one"""
+
+        if config not in self.fields:
+            return None
+
+        # Remember configuration as recently requested, wake up producer to replace the field
+        self.fields.move_to_end(config)
+        self._wanted.set()
+
+        fields = self.fields[config]
+        return fields.popleft() if fields else None
+
+    def track(self, config: tuple, seconds: float) -> None:
+        """Start keeping fields of configuration ready if its on-demand generation was cheap (evicts the least recent one over limit)
+
+        seconds -- how long the on-demand generation took
+        """
+
+        _, width, height, _ = config
+        if config in self.fields or width * height > self.max_tiles or seconds > self.max_seconds:
+            return
+
+        self.fields[config] = deque(maxlen=self.size)
+        for old in list(self.fields):
+            if len(self.fields) <= self.tracked:
+                break
+            if old != self.default:
+                del self.fields[old]
+
+        self._wanted.set()
+
+    def forget(self, config: tuple) -> None:
+        """Stop keeping fields of configuration ready (for example because it failed to generate)"""
+
+        if config != self.default:
+            self.fields.pop(config, None)
+
+    def missing(self):
+        """Return configuration to generate next (default first, then most recent), None if pool is full"""
+
+        for config in [self.default] + list(reversed(self.fields)):
+            if len(self.fields[config]) < self.size:
+                return config
+
+        return None
+
+    async def run(self, loop: asyncio.AbstractEventLoop, idle_threshold: float = 0.01) -> None:
+        """Keep refilling the pool, one field at a time, whenever the event loop is idle"""
+
+        while True:
+            await self._wanted.wait()
+
+            config = self.missing()
+            if config is None:
+                self._wanted.clear()
+                continue
+
+            # Short sleep overshooting its deadline means other tasks are keeping the loop busy -> back off
+            before = loop.time()
+            await asyncio.sleep(0.05)
+            if loop.time() - before - 0.05 > idle_threshold:
+                await asyncio.sleep(1)
+                continue
+
+            try:
+                field = await loop.run_in_executor(None, render_minefield, *config)
+
+            # Unsatisfiable configuration -> stop tracking it
+            except (MinesweeperError, OverflowError):
+                self.forget(config)
+                continue
+
+            # Configuration could have been evicted in the meantime
+            if config in self.fields:
+                self.fields[config].append(field)
@@ -1,76 +1,409 @@
-import random
-import re
+import time
+from functools import lru_cache
 
 import numpy as np
 
 
+# Rendered tile for every board value, indexed by value + 1 (bombs are -1)
+TILES = np.array(["💣", "0️⃣", "1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣"], dtype=object)
+SPOILERED_TILES = np.array(["||" + tile + "||" for tile in TILES], dtype=object)
+# Denser no-guess fields are almost never solvable, generating them only burns time
+MAX_NO_GUESS_DENSITY = 0.25
+
+
+class MinesweeperError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+@lru_cache(maxsize=32)
+def adjacent_tiles(width: int, height: int) -> tuple:
+    """Flat indices of the (up to 8) neighbours of every tile of a board with given dimensions"""
+
+    adjacent = []
+    for y in range(height):
+        for x in range(width):
+            adjacent.append(tuple(j * width + i
+                                  for j in range(max(0, y - 1), min(height, y + 2))
+                                  for i in range(max(0, x - 1), min(width, x + 2))
+                                  if i != x or j != y))
+
+    return tuple(adjacent)
+
+
+def unsolved_tiles(board: np.ndarray, start: tuple) -> list:
+    """Return flat indices of tiles that can't be deduced from the start tile without guessing (empty if solvable)
+
+    Uses constraint propagation: trivial rules on single numbers, subset rule on pairs of overlapping
+    numbers and the global bomb count.
+    """
+
+    height, width = board.shape
+    values = board.ravel().tolist()
+    adjacent = adjacent_tiles(width, height)
+
+    # None = hidden, True = revealed, False = flagged
+    state = [None] * len(values)
+    hidden = len(values)
+    bombs_left = values.count(-1)
+
+    # Revealed numbers which still have hidden neighbours
+    frontier = set()
+
+    def reveal(tile):
+        nonlocal hidden
+        stack = [tile]
+        while stack:
+            tile = stack.pop()
+            if state[tile] is not None:
+                continue
+            state[tile] = True
+            hidden -= 1
+            if values[tile] == 0:
+                stack.extend(t for t in adjacent[tile] if state[t] is None)
+            else:
+                frontier.add(tile)
+
+    def flag(tile):
+        nonlocal hidden, bombs_left
+        if state[tile] is None:
+            state[tile] = False
+            hidden -= 1
+            bombs_left -= 1
+
+    reveal(start[0] * width + start[1])
+
+    while hidden > bombs_left:
+        progress = False
+        constraints = []
+
+        for tile in list(frontier):
+            unknown = [t for t in adjacent[tile] if state[t] is None]
+            if not unknown:
+                frontier.discard(tile)
+                continue
+
+            bombs = values[tile] - sum(1 for t in adjacent[tile] if state[t] is False)
+
+            # All remaining neighbours are safe
+            if bombs == 0:
+                for t in unknown:
+                    reveal(t)
+                progress = True
+
+            # All remaining neighbours are bombs
+            elif bombs == len(unknown):
+                for t in unknown:
+                    flag(t)
+                progress = True
+
+            else:
+                constraints.append((frozenset(unknown), bombs))
+
+        if progress:
+            continue
+
+        # Subset rule: if A is a subset of B, tiles in B - A hold exactly bombs(B) - bombs(A) bombs
+        containing = {}
+        for constraint in constraints:
+            for tile in constraint[0]:
+                containing.setdefault(tile, []).append(constraint)
+
+        for a, a_bombs in constraints:
+            # Any superset of A has to contain A's first tile
+            for b, b_bombs in containing[next(iter(a))]:
+                if not a < b:
+                    continue
+                rest = b - a
+                if b_bombs == a_bombs:
+                    for t in rest:
+                        reveal(t)
+                    progress = True
+                elif b_bombs - a_bombs == len(rest):
+                    for t in rest:
+                        flag(t)
+                    progress = True
+
+        if progress:
+            continue
+
+        # Global rule: every remaining bomb is accounted for by the frontier
+        if bombs_left == 0:
+            for tile in range(len(values)):
+                if state[tile] is None:
+                    reveal(tile)
+            continue
+
+        return [tile for tile in range(len(values)) if state[tile] is None]
+
+    return []
+
+
+def solvable(board: np.ndarray, start: tuple) -> bool:
+    """Check whether the whole board can be cleared from the start tile without guessing"""
+
+    return not unsolved_tiles(board, start)
+
+
 class Minesweeper:
     board = None
+    start = None
+
+    def __init__(self, width: int = 16, height: int = 16, bombs: int = 40, no_guess: bool = False, attempts: int = 200, repairs: int = 20,
+                 timeout: float = 5.0):
+        """Generate a random minefield
 
-    def __init__(self, width: int = 16, height: int = 16, bombs: int = 40):
+        no_guess -- regenerate until the field is solvable from the unspoiled start tile (which is always a 0)
+        attempts -- maximum number of freshly generated fields in no-guess mode
+        repairs -- maximum number of bombs moved away from where the solver got stuck, per generated field
+        timeout -- maximum seconds spent generating in no-guess mode
+        """
 
         if bombs > width * height:
             raise OverflowError("More bombs than tiles")
 
-        # Create empty board
-        board = np.zeros(width * height, dtype=int)
+        rng = np.random.default_rng()
+
+        if not no_guess:
+            # Pick distinct bomb positions directly instead of shuffling the whole board
+            mines = np.zeros(width * height, dtype=bool)
+            mines[rng.choice(width * height, size=bombs, replace=False)] = True
+
+            # Label tiles around bombs
+            self.board = Minesweeper.explore(mines.reshape((height, width)))
+
+            # Tile left unspoiled (lowest adjacent bomb count, random among ties), None if the board is all bombs
+            safe = np.flatnonzero(self.board >= 0)
+            if safe.size:
+                values = self.board.ravel()[safe]
+                self.start = divmod(int(rng.choice(safe[values == values.min()])), width)
+
+            return
+
+        deadline = time.monotonic() + timeout
+
+        for _ in range(attempts):
+            if time.monotonic() > deadline:
+                break
+
+            # Keep 3x3 area around start tile free of bombs, so the start tile opens up a region
+            start = (int(rng.integers(height)), int(rng.integers(width)))
+            allowed = np.ones((height, width), dtype=bool)
+            allowed[max(0, start[0] - 1):start[0] + 2, max(0, start[1] - 1):start[1] + 2] = False
+            allowed = allowed.ravel()
+
+            if bombs > np.count_nonzero(allowed):
+                raise OverflowError("Too many bombs to leave the start tile empty")
+
+            mines = np.zeros(width * height, dtype=bool)
+            mines[rng.choice(np.flatnonzero(allowed), size=bombs, replace=False)] = True
+
+            for _ in range(repairs + 1):
+                board = Minesweeper.explore(mines.reshape((height, width)))
+                unsolved = unsolved_tiles(board, start)
+
+                if not unsolved:
+                    self.board = board
+                    self.start = start
+                    return
 
-        # Add bombs
-        for i in range(bombs):
-            board[i] = 1
+                # Local repair: move a bomb the solver got stuck on somewhere the solver hasn't reached yet
+                unsolved = np.array(unsolved)
+                reached = np.ones(width * height, dtype=bool)
+                reached[unsolved] = False
+                border = np.zeros(width * height, dtype=bool)
+                border[[t for tile in np.flatnonzero(reached) for t in adjacent_tiles(width, height)[tile]]] = True
 
-        # Shuffle bombs around
-        np.random.default_rng().shuffle(board)
+                stuck = unsolved[mines[unsolved] & border[unsolved]]
+                free = unsolved[~mines[unsolved] & ~border[unsolved] & allowed[unsolved]]
+                if not stuck.size or not free.size or time.monotonic() > deadline:
+                    break
 
-        # Shape board into desired dimensions
-        board = board.reshape((height, width))
+                mines[rng.choice(stuck)] = False
+                mines[rng.choice(free)] = True
 
-        # Label tiles around bombs
-        self.board = Minesweeper.explore(board)
+        raise MinesweeperError("Couldn't generate a minefield solvable without guessing, try fewer bombs.")
 
     @classmethod
     def explore(cls, board: np.ndarray) -> np.ndarray:
         """Mark every tile with the number of bombs in 3x3 area surrounding it, bombs marked as -1"""
 
         height, width = board.shape
-        explored = np.zeros((height, width), dtype=int)
+        mines = board.astype(np.int8)
 
-        def mark_adjacent(x, y):
-            """Increment value of 3x3 tiles around bomb by 1"""
-            for i in range(max(0, x - 1), min(width, x + 2)):
-                for j in range(max(0, y - 1), min(height, y + 2)):
-                    explored[j][i] += 1
+        # Sum of 9 shifted copies of the zero-padded board = bombs in each 3x3 area
+        padded = np.pad(mines, 1)
+        explored = np.zeros((height, width), dtype=np.int8)
+        for dy in range(3):
+            for dx in range(3):
+                explored += padded[dy:dy + height, dx:dx + width]
 
-        for y in range(height):
-            for x in range(width):
-                if board[y][x] == 1:
-                    mark_adjacent(x, y)
-                    explored[y][x] = -10
+        explored[mines == 1] = -1
+        return explored
 
-        return explored.clip(-1, 9)
+    def rows(self, spoiler: bool = False) -> list:
+        """Return every row of the board rendered as a string"""
+
+        tiles = SPOILERED_TILES[self.board + 1] if spoiler else TILES[self.board + 1]
+
+        # Remove spoiler on the starting tile
+        if spoiler and self.start is not None:
+            tiles[self.start] = TILES[self.board[self.start] + 1]
+
+        return ["".join(row) for row in tiles]
 
     def to_string(self, spoiler: bool = False) -> str:
-        string = ""
-
-        # Add each row
-        for row in self.board[::-1]:
-            string += "_" + "_".join([str(n) for n in row])
-            string += "\n"
-
-        tiles = ["0️⃣", "1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "💣"]
-
-        if not spoiler:
-            for i in range(-1, 10):
-                string = string.replace(f"_{i}", f"{tiles[i]}")
-        else:
-            for i in range(-1, 10):
-                string = string.replace(f"_{i}", f"||{tiles[i]}||")
-
-            # Remove spoiler on one non-bomb tile (attempt to find tile with the lowest adjacent bombs)
-            for i in range(10):
-                matches = list(re.finditer(f"\\|\\|{tiles[i]}\\|\\|", string))
-                if len(matches) != 0:
-                    replace = random.choice(matches)
-                    return string[:replace.start()] + tiles[i] + string[replace.end():]
-
-        return string
+        return "\n".join(self.rows(spoiler)) + "\n"
+
+    def to_messages(self, spoiler: bool = False, limit: int = 2000) -> list:
+        """Split rendered board into as few messages as possible, each at most `limit` characters long"""
+
+        messages = []
+        current = ""
+
+        for row in self.rows(spoiler):
+            if len(row) + 1 > limit:
+                raise OverflowError("Board too wide to fit into a message")
+
+            if len(current) + len(row) + 1 > limit:
+                messages.append(current)
+                current = ""
+
+            current += row + "\n"
+
+        if current:
+            messages.append(current)
+
+        return messages
+
+
+def label_zero_regions(board: np.ndarray) -> tuple:
+    """Label connected regions of zeros, return (labels, regions)
+
+    labels -- flat array, label of the zero region every tile belongs to (0 for non-zero tiles)
+    regions -- for every label, flat indices of the tiles revealed by clicking a zero in that region (zeros + border)
+    """
+
+    height, width = board.shape
+    values = board.ravel()
+    adjacent = adjacent_tiles(width, height)
+
+    labels = np.zeros(width * height, dtype=np.int32)
+    regions = [np.empty(0, dtype=np.int32)]
+
+    for tile in np.flatnonzero(values == 0).tolist():
+        if labels[tile]:
+            continue
+
+        # Flood fill region of zeros, collecting its border along the way
+        label = len(regions)
+        labels[tile] = label
+        region = {tile}
+        stack = [tile]
+        while stack:
+            for t in adjacent[stack.pop()]:
+                region.add(t)
+                if values[t] == 0 and not labels[t]:
+                    labels[t] = label
+                    stack.append(t)
+
+        regions.append(np.fromiter(region, dtype=np.int32, count=len(region)))
+
+    return labels, regions
+
+
+class MinesweeperGame:
+    """Interactive game on top of a generated minefield"""
+
+    HIDDEN = 0
+    REVEALED = 1
+    FLAGGED = 2
+
+    # Column and row coordinates (interactive games are at most 10x10)
+    COORDINATES = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+
+    def __init__(self, field: Minesweeper):
+        height, width = field.board.shape
+        if width > len(self.COORDINATES) or height > len(self.COORDINATES):
+            raise OverflowError("Interactive board can be at most 10x10")
+
+        self.width = width
+        self.height = height
+        self.values = field.board.ravel()
+        self.state = np.full(width * height, self.HIDDEN, dtype=np.uint8)
+        self.safe_hidden = int(np.count_nonzero(self.values >= 0))
+        self.over = False
+        self.exploded = None
+
+        # Zero regions are labelled once, so revealing one is a single lookup instead of a flood fill
+        self.labels, self.regions = label_zero_regions(field.board)
+
+        # Rendered rows, only changed ones get re-rendered
+        self._rows = [self._render_row(y) for y in range(height)]
+
+        if field.start is not None:
+            self.reveal(field.start[1], field.start[0])
+
+    def _render_row(self, y: int) -> str:
+        """Render one row of the board (with its coordinate)"""
+
+        row = slice(y * self.width, (y + 1) * self.width)
+        state = self.state[row]
+        tiles = np.where(state == self.REVEALED, TILES[self.values[row] + 1], np.where(state == self.FLAGGED, "🚩", "🟦"))
+
+        if self.exploded is not None and self.exploded // self.width == y:
+            tiles[self.exploded % self.width] = "💥"
+
+        return self.COORDINATES[y] + "".join(tiles)
+
+    def reveal(self, x: int, y: int):
+        """Reveal tile, return True if it was a bomb, False if it wasn't, None if it can't be revealed"""
+
+        tile = y * self.width + x
+        if self.over or self.state[tile] != self.HIDDEN:
+            return None
+
+        # Bomb -> game over, show everything
+        if self.values[tile] < 0:
+            self.over = True
+            self.state[:] = self.REVEALED
+            self.exploded = tile
+            self._rows = [self._render_row(row) for row in range(self.height)]
+            return True
+
+        # Zero -> whole region + its border, otherwise just the tile
+        label = self.labels[tile]
+        tiles = self.regions[label] if label else np.array([tile])
+
+        newly = tiles[self.state[tiles] != self.REVEALED]
+        self.state[newly] = self.REVEALED
+        self.safe_hidden -= newly.size
+
+        for row in np.unique(newly // self.width).tolist():
+            self._rows[row] = self._render_row(row)
+
+        if self.safe_hidden == 0:
+            self.over = True
+
+        return False
+
+    def flag(self, x: int, y: int) -> bool:
+        """Toggle flag on tile, return False if tile is already revealed"""
+
+        tile = y * self.width + x
+        if self.over or self.state[tile] == self.REVEALED:
+            return False
+
+        self.state[tile] = self.FLAGGED if self.state[tile] == self.HIDDEN else self.HIDDEN
+        self._rows[y] = self._render_row(y)
+
+        return True
+
+    def won(self) -> bool:
+        return self.safe_hidden == 0
+
+    def to_string(self) -> str:
+        return "⬛" + "".join(self.COORDINATES[:self.width]) + "\n" + "\n".join(self._rows) + "\n"
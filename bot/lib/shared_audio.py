@@ -0,0 +1,207 @@
+import threading
+
+import discord
+
+
+# Duration of one Opus packet (seconds)
+PACKET_DURATION = 0.02
+
+
+class SharedDecoder:
+    """Single audio source (FFmpeg process) whose Opus packets are read by any number of readers
+
+    Packets are kept in a ring buffer. Decoding stays only a little ahead of the fastest reader, so until
+    the buffer wraps around, a new reader can still start from the first packet.
+    """
+
+    def __init__(self, key: tuple, source: discord.AudioSource, capacity: int, lead: int):
+        """
+        capacity -- packets kept in ring buffer
+        lead -- maximum number of packets decoded ahead of the fastest reader
+        """
+
+        self.key = key
+        self.source = source
+        self.capacity = capacity
+        self.lead = lead
+
+        self.buffer = [b""] * capacity
+        self.produced = 0
+        self.finished = False
+        self.stopped = False
+
+        # Reader -> index of next packet it reads
+        self.positions = dict()
+        self.condition = threading.Condition()
+
+        threading.Thread(target=self._decode, name="shared-decoder", daemon=True).start()
+
+    def _decode(self) -> None:
+        """Read packets from source into ring buffer"""
+
+        while True:
+            with self.condition:
+                # Wait for first reader, don't run too far ahead of the fastest one
+                while not self.stopped and (not self.positions or self.produced - max(self.positions.values()) >= self.lead):
+                    self.condition.wait()
+                if self.stopped:
+                    break
+
+            packet = self.source.read()
+
+            with self.condition:
+                if not packet:
+                    self.finished = True
+                    self.condition.notify_all()
+                    break
+
+                self.buffer[self.produced % self.capacity] = packet
+                self.produced += 1
+                self.condition.notify_all()
+
+        self.source.cleanup()
+
+    def oldest(self) -> int:
+        """Index of the oldest packet still in ring buffer"""
+
+        return max(0, self.produced - self.capacity)
+
+    def attach(self, reader, position: int = 0) -> bool:
+        """Add reader at position (packet index), False if that packet was already overwritten"""
+
+        with self.condition:
+            if self.stopped or position < self.oldest():
+                return False
+
+            self.positions[reader] = position
+            self.condition.notify_all()
+
+            return True
+
+    def detach(self, reader) -> bool:
+        """Remove reader, stop decoding if it was the last one (returns True if stopped)"""
+
+        with self.condition:
+            self.positions.pop(reader, None)
+            if not self.positions:
+                self.stopped = True
+            self.condition.notify_all()
+
+            return self.stopped
+
+    def read(self, reader):
+        """Return reader's next packet (waits for decoder), empty bytes when source is exhausted
+
+        Returns None if reader fell so far behind its packet was overwritten.
+        """
+
+        with self.condition:
+            position = self.positions[reader]
+            if position < self.oldest():
+                return None
+
+            while position >= self.produced and not self.finished and not self.stopped:
+                self.condition.wait()
+
+            if position >= self.produced:
+                return b""
+
+            packet = self.buffer[position % self.capacity]
+            self.positions[reader] = position + 1
+            self.condition.notify_all()
+
+            return packet
+
+
+class SharedReader(discord.AudioSource):
+    """Voice client's view of a shared decoder, with its own position"""
+
+    def __init__(self, registry, track: str, create_source):
+        self.registry = registry
+        self.track = track
+        self.create_source = create_source
+
+        # Packets read, counted from the start of the track
+        self.played = 0
+
+        self.decoder = None
+        self.offset = 0.0
+
+    def read(self):
+        packet = self.decoder.read(self)
+
+        # Fell behind (paused for long) -> continue from own decoder starting where it stopped
+        if packet is None:
+            self.registry.move(self, self.played * PACKET_DURATION)
+            packet = self.decoder.read(self)
+
+        if packet:
+            self.played += 1
+
+        return packet
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if self.decoder is not None:
+            self.registry.release(self)
+
+
+class SharedAudioRegistry:
+    """Shares Opus decoders between guilds playing the same track, one decoder per (track, start offset)"""
+
+    def __init__(self, capacity: int, lead: int = 250):
+        """
+        capacity -- packets buffered per decoder (one packet is 20 ms of audio)
+        lead -- packets decoded ahead of the fastest reader
+        """
+
+        self.capacity = capacity
+        self.lead = lead
+        self.decoders = dict()
+        self.lock = threading.Lock()
+
+    def reader(self, track: str, create_source) -> SharedReader:
+        """Return reader of track from its beginning
+
+        create_source -- callable taking start offset (seconds) and returning Opus source of the track,
+                         called only if no running decoder can serve the reader
+        """
+
+        reader = SharedReader(self, track, create_source)
+        self.move(reader, 0.0)
+
+        return reader
+
+    def move(self, reader: SharedReader, offset: float) -> None:
+        """Attach reader to decoder of its track starting at offset (reusing running one if possible)"""
+
+        with self.lock:
+            if reader.decoder is not None:
+                self._detach(reader)
+
+            key = (reader.track, offset)
+            decoder = self.decoders.get(key)
+
+            # Late joiner whose start was already overwritten gets a fresh decoder
+            if decoder is None or not decoder.attach(reader):
+                decoder = SharedDecoder(key, reader.create_source(offset), self.capacity, self.lead)
+                decoder.attach(reader)
+                self.decoders[key] = decoder
+
+            reader.decoder = decoder
+            reader.offset = offset
+
+    def release(self, reader: SharedReader) -> None:
+        """Detach reader, forget decoder once nobody reads it"""
+
+        with self.lock:
+            self._detach(reader)
+
+    def _detach(self, reader: SharedReader) -> None:
+        decoder = reader.decoder
+        reader.decoder = None
+
+        if decoder.detach(reader) and self.decoders.get(decoder.key) is decoder:
+            del self.decoders[decoder.key]
@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import logging
+import random
+import urllib.parse
+
+from lib.garfield_strip import GarfieldError, GarfieldConnectionError, latest_release, scrape_strip, strip_url
+from lib.strip_index import StripIndex
+
+
+log = logging.getLogger(__name__)
+
+# First Garfield strip
+FIRST_STRIP = datetime.datetime(1978, 6, 19)
+
+
+class StripBackfill:
+    """Background crawler indexing every Garfield strip, so commands never have to scrape
+
+    Progress is the index itself (and its table of dates without a strip), an interrupted crawl continues
+    with the dates still missing. Once the archive is complete, only the newest days get checked.
+    """
+
+    def __init__(self, index: StripIndex, concurrency: int = 4, rate: float = 1.0, retries: int = 4, backoff: float = 5.0):
+        """
+        concurrency -- pages fetched at the same time
+        rate -- maximum requests per second to one host
+        retries -- attempts after a connection error (or overloaded server) before giving the date up until next crawl
+        backoff -- seconds before the first retry, doubled with every next one
+        """
+
+        self.index = index
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+
+        # Host -> earliest time (loop.time) of its next request
+        self.next_request = dict()
+
+        self.fetched = 0
+        self.failed = 0
+
+    def pending(self, days: int = None, recheck_days: int = 7) -> list:
+        """Dates without indexed strip, newest first
+
+        days -- only check this many newest days (whole archive if None)
+        recheck_days -- dates known to have no strip are skipped, unless they're this recent
+        """
+
+        # Newest strip which is already out (US Eastern date)
+        latest = latest_release(datetime.datetime.utcnow())
+        recent = latest - datetime.timedelta(days=recheck_days)
+        first = FIRST_STRIP if days is None else max(FIRST_STRIP, latest - datetime.timedelta(days=days - 1))
+
+        dates = []
+        date = latest
+        while date >= first:
+            if date not in self.index and (date >= recent or not self.index.is_missing(date)):
+                dates.append(date)
+            date -= datetime.timedelta(days=1)
+
+        return dates
+
+    async def throttle(self, url: str, loop: asyncio.AbstractEventLoop) -> None:
+        """Wait for host's next free request slot"""
+
+        host = urllib.parse.urlparse(url).netloc
+        now = loop.time()
+        slot = max(now, self.next_request.get(host, now))
+        self.next_request[host] = slot + 1 / self.rate
+
+        await asyncio.sleep(slot - now)
+
+    async def fetch(self, date: datetime.datetime, loop: asyncio.AbstractEventLoop) -> None:
+        """Scrape strip into index, retrying with exponential backoff"""
+
+        for attempt in range(self.retries + 1):
+            await self.throttle(strip_url(date), loop)
+
+            try:
+                await scrape_strip(date, loop=loop)
+                self.fetched += 1
+                return
+
+            except GarfieldConnectionError:
+                if attempt == self.retries:
+                    self.failed += 1
+                    return
+                await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(1, 1.5))
+
+            # Page without a strip
+            except GarfieldError:
+                self.index.mark_missing(date)
+                return
+
+    async def crawl(self, dates: list, loop: asyncio.AbstractEventLoop) -> None:
+        """Fetch all dates, `concurrency` at a time"""
+
+        queue = asyncio.Queue()
+        for date in dates:
+            queue.put_nowait(date)
+
+        async def worker():
+            while not queue.empty():
+                await self.fetch(queue.get_nowait(), loop)
+
+        workers = [loop.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def run(self, *, loop=None, interval: float = 3600) -> None:
+        """Crawl the whole archive, then keep checking for new strips every `interval` seconds"""
+
+        loop = loop or asyncio.get_event_loop()
+
+        dates = self.pending()
+        if dates:
+            log.info("Backfilling %d Garfield strips", len(dates))
+            await self.crawl(dates, loop)
+            log.info("Garfield backfill done, %d strips fetched, %d failed", self.fetched, self.failed)
+
+        last_full = loop.time()
+        while True:
+            await asyncio.sleep(interval)
+
+            # Newest days, once a day also dates which failed before
+            if loop.time() - last_full >= 86400:
+                last_full = loop.time()
+                await self.crawl(self.pending(), loop)
+            else:
+                await self.crawl(self.pending(days=7), loop)
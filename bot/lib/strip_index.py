@@ -0,0 +1,69 @@
+import datetime
+import sqlite3
+
+
+class StripIndex:
+    """Persistent date -> Garfield strip image URL mapping
+
+    A published strip's URL never changes, so once a strip is found it never has to be scraped again.
+    All URLs are also kept in memory, lookups don't touch the disk.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        # Write-ahead log -> commits don't wait for a full sync of the database file
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS strips (date TEXT PRIMARY KEY, url TEXT NOT NULL)")
+        # Dates whose page exists but has no strip (or doesn't exist), so backfill doesn't keep asking for them
+        self.connection.execute("CREATE TABLE IF NOT EXISTS missing (date TEXT PRIMARY KEY)")
+        self.connection.commit()
+
+        # ISO date -> URL
+        self.urls = dict(self.connection.execute("SELECT date, url FROM strips"))
+        self.missing = {date for date, in self.connection.execute("SELECT date FROM missing")}
+
+    @staticmethod
+    def key(date: datetime.date) -> str:
+        return date.strftime("%Y-%m-%d")
+
+    def get(self, date: datetime.date):
+        """Return URL of strip released on date, None if it isn't indexed"""
+
+        return self.urls.get(self.key(date))
+
+    def add(self, date: datetime.date, url: str) -> None:
+        self.add_many([(date, url)])
+
+    def add_many(self, strips: list) -> None:
+        """Index (date, URL) pairs in a single transaction"""
+
+        rows = [(self.key(date), url) for date, url in strips if self.urls.get(self.key(date)) != url]
+        if not rows:
+            return
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO strips (date, url) VALUES (?, ?)", rows)
+            self.connection.executemany("DELETE FROM missing WHERE date = ?", [(date,) for date, _ in rows])
+        self.urls.update(rows)
+        self.missing.difference_update(date for date, _ in rows)
+
+    def mark_missing(self, date: datetime.date) -> None:
+        """Remember there is no strip on date"""
+
+        key = self.key(date)
+        if key in self.missing:
+            return
+
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO missing (date) VALUES (?)", (key,))
+        self.missing.add(key)
+
+    def is_missing(self, date: datetime.date) -> bool:
+        return self.key(date) in self.missing
+
+    def __contains__(self, date: datetime.date) -> bool:
+        return self.key(date) in self.urls
+
+    def __len__(self) -> int:
+        return len(self.urls)
@@ -0,0 +1,44 @@
+import sqlite3
+
+
+class Subscriptions:
+    """Persistent set of text channels subscribed to the daily Garfield post"""
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS subscriptions (channel_id INTEGER PRIMARY KEY, guild_id INTEGER)")
+        self.connection.commit()
+
+        self.channels = {channel_id for channel_id, in self.connection.execute("SELECT channel_id FROM subscriptions")}
+
+    def add(self, channel_id: int, guild_id: int) -> bool:
+        """Subscribe channel, False if it already was subscribed"""
+
+        if channel_id in self.channels:
+            return False
+
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO subscriptions (channel_id, guild_id) VALUES (?, ?)", (channel_id, guild_id))
+        self.channels.add(channel_id)
+
+        return True
+
+    def remove(self, channel_id: int) -> bool:
+        """Unsubscribe channel, False if it wasn't subscribed"""
+
+        if channel_id not in self.channels:
+            return False
+
+        with self.connection:
+            self.connection.execute("DELETE FROM subscriptions WHERE channel_id = ?", (channel_id,))
+        self.channels.discard(channel_id)
+
+        return True
+
+    def remove_guild(self, guild_id: int) -> None:
+        """Unsubscribe all channels of guild"""
+
+        with self.connection:
+            channels = {channel_id for channel_id, in self.connection.execute("SELECT channel_id FROM subscriptions WHERE guild_id = ?", (guild_id,))}
+            self.connection.execute("DELETE FROM subscriptions WHERE guild_id = ?", (guild_id,))
+        self.channels -= channels
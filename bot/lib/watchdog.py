@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from discord.ext import commands
+
+
+log = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """Detects callbacks blocking the event loop
+
+    A coroutine running on the loop keeps updating a heartbeat, a separate thread checks it. When the
+    heartbeat is late by more than the threshold, the thread samples the loop thread's stack and blames
+    the command (or other callback) found in it.
+    """
+
+    def __init__(self, bot: commands.Bot, threshold: float = 0.25, interval: float = 0.05):
+        """
+        threshold -- shortest blocking time (seconds) reported as a stall
+        interval -- how often (seconds) heartbeat is updated and checked
+        """
+
+        self.bot = bot
+        self.threshold = threshold
+        self.interval = interval
+
+        # Command / callback name -> number of stalls, total and longest stall duration
+        self.stalls = Counter()
+        self.stalled_time = Counter()
+        self.longest = dict()
+
+        # Latest measured event loop lag (seconds)
+        self.lag = 0.0
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+
+    async def run(self) -> None:
+        """Keep heartbeat up to date (run as task on the watched loop)"""
+
+        self._loop_thread = threading.get_ident()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+        while True:
+            before = time.monotonic()
+            self._heartbeat = before
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.monotonic() - before - self.interval)
+
+    def _watch(self) -> None:
+        """Check heartbeat from a separate thread, report stalls"""
+
+        while True:
+            time.sleep(self.interval)
+
+            beat = self._heartbeat
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+
+            # Loop is stuck right now -> sample what it's doing
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            culprit = self.culprit(frame)
+            stack = "".join(traceback.format_stack(frame))
+            del frame
+
+            # Wait for the loop to recover, to report the whole duration
+            while self._heartbeat == beat:
+                time.sleep(self.interval)
+            duration = time.monotonic() - beat - self.interval
+
+            self.stalls[culprit] += 1
+            self.stalled_time[culprit] += duration
+            self.longest[culprit] = max(duration, self.longest.get(culprit, 0.0))
+
+            log.warning("Event loop blocked for %.3f s by %s, stack sample:\n%s", duration, culprit, stack)
+
+    def culprit(self, frame) -> str:
+        """Name of the command running in frame's stack, otherwise name of the callback the loop is running"""
+
+        callbacks = {command.callback.__code__: command.qualified_name for command in self.bot.walk_commands()}
+
+        callback = "unknown"
+        while frame is not None:
+            if frame.f_code in callbacks:
+                return "p." + callbacks[frame.f_code]
+
+            # Reached the loop running the callback -> last frame before it is the callback (or task's coroutine)
+            if frame.f_code.co_filename.endswith(os.path.join("asyncio", "events.py")):
+                break
+
+            if "asyncio" not in frame.f_code.co_filename:
+                callback = frame.f_code.co_name
+
+            frame = frame.f_back
+
+        return callback
+
+    def report(self, limit: int = 10) -> str:
+        """Stall counters as a human readable string"""
+
+        if not self.stalls:
+            return "No stalls longer than {0} ms detected, current lag `{1:.0f} ms`.".format(int(self.threshold * 1000), self.lag * 1000)
+
+        lines = ["Event loop stalls (> {0} ms), current lag `{1:.0f} ms`:".format(int(self.threshold * 1000), self.lag * 1000)]
+        for culprit, count in self.stalls.most_common(limit):
+            lines.append("`{0}` - {1}x, total `{2:.2f} s`, longest `{3:.2f} s`".format(culprit, count, self.stalled_time[culprit], self.longest[culprit]))
+
+        return "\n".join(lines)
@@ -1,9 +1,15 @@
+import asyncio
 import datetime
 import random
 
 import wikipedia
 
+from lib.config import fact_store_path
 from lib.emotes import basic_emoji
+from lib.fact_store import FactStore
+
+
+fact_store = FactStore(fact_store_path)
 
 
 class WikipediaError(Exception):
@@ -14,7 +20,24 @@ class WikipediaError(Exception):
         return self.message
 
 
-def get_day_fact(date: datetime.datetime) -> str:
+async def get_day_fact(date: datetime.datetime, *, loop=None, years: list = ()) -> str:
+    """Return random fact about day, from local fact store if it's there
+
+    years -- (first, last) year ranges preferred in order, before facts from any year
+    """
+
+    fact = fact_store.random_fact(date.month, date.day, years)
+    if fact is not None:
+        return fact
+
+    # Day not stored (yet) -> ask Wikipedia directly
+    loop = loop or asyncio.get_event_loop()
+    return await loop.run_in_executor(None, fetch_day_fact, date)
+
+
+def fetch_day_fact(date: datetime.datetime) -> str:
+    """Return random fact about day from its Wikipedia page"""
+
     # Try to find an interesting fact
     try:
         raw = wikipedia.page(date.strftime("%B") + " " + str(date.day)).section("Events")
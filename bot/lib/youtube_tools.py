@@ -1,23 +1,34 @@
+import asyncio
+import datetime
 import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
 from googleapiclient.discovery import build
 
+from lib.config import youtube_daily_quota, youtube_search_ttl
 from lib.discord_interface import add_choices_message, wait_for_choice
 from lib.emotes import basic_emoji
+from lib.metrics import music_metrics
 
 
 YOUTUBE_API_TOKEN = os.getenv("YOUTUBE_API_TOKEN")
 youtube = build("youtube", "v3", developerKey=YOUTUBE_API_TOKEN)
 
 
+class QuotaExceededError(ConnectionError):
+    pass
+
+
 def youtube_search(title: str) -> list:
     """Return top 5 results (videos only, no channels or playlists)"""
 
     assert not title.isspace()
 
     try:
-        search_response = youtube.search().list(q=title, part="id,snippet", maxResults=10).execute()
+        search_response = youtube.search().list(q=title, part="id,snippet", type="video", maxResults=5).execute()
     except:  # Google has awful documentation, it's impossible to find which exceptions a method can throw
         raise ConnectionError
 
@@ -37,8 +48,113 @@ def youtube_search(title: str) -> list:
     return videos
 
 
-async def select_video(bot: discord.ext.commands.Bot, ctx: discord.ext.commands.Context, query: str) -> str:
-    """Extract Youtube URL, returns empty string if failed"""
+class YoutubeSearch:
+    """Asynchronous Youtube search with cache of recent results and API quota accounting
+
+    Queries differing only in case and whitespace share a cache entry. Identical queries running at
+    the same time share one API request. Requests run one at a time in a dedicated thread, the API client
+    (its HTTP connection) isn't thread-safe.
+    """
+
+    # Quota units one search request costs
+    SEARCH_COST = 100
+
+    def __init__(self, ttl: float, daily_quota: int, size: int = 1024):
+        """
+        ttl -- seconds a result stays cached
+        daily_quota -- API units available per day (Google resets quota at midnight Pacific time)
+        size -- maximum number of cached queries
+        """
+
+        self.ttl = ttl
+        self.daily_quota = daily_quota
+        self.size = size
+
+        # Normalized query -> (time cached, results), least recently used first
+        self.cache = OrderedDict()
+        # Normalized query -> future of request in progress
+        self.pending = dict()
+
+        self.quota_day = None
+        self.quota_used = 0
+
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="youtube-search")
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _spend_quota(self) -> None:
+        """Account for one search request, raise QuotaExceededError if there's no quota left today"""
+
+        # Approximation of Pacific time (ignoring daylight saving time)
+        day = (datetime.datetime.utcnow() - datetime.timedelta(hours=8)).date()
+        if day != self.quota_day:
+            self.quota_day = day
+            self.quota_used = 0
+
+        if self.quota_used + self.SEARCH_COST > self.daily_quota:
+            raise QuotaExceededError
+
+        self.quota_used += self.SEARCH_COST
+
+    async def search(self, query: str, *, loop=None) -> list:
+        """Return top 5 results, from cache if searched for recently"""
+
+        loop = loop or asyncio.get_event_loop()
+        key = self.normalize(query)
+
+        cached = self.cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl:
+            self.cache.move_to_end(key)
+            music_metrics.count("search_cache_hits")
+            return cached[1]
+
+        # Same query already being searched -> wait for its result (shielded, a cancelled waiter doesn't cancel others)
+        if key in self.pending:
+            music_metrics.count("search_cache_hits")
+            return await asyncio.shield(self.pending[key])
+
+        music_metrics.count("search_cache_misses")
+        self._spend_quota()
+
+        request = loop.run_in_executor(self.executor, youtube_search, key)
+        self.pending[key] = request
+        try:
+            with music_metrics.timer("search_seconds"):
+                videos = await asyncio.shield(request)
+        finally:
+            self.pending.pop(key, None)
+
+        self.cache[key] = (time.monotonic(), videos)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+        return videos
+
+
+searches = YoutubeSearch(ttl=youtube_search_ttl, daily_quota=youtube_daily_quota)
+
+
+def playlist_url(query: str) -> str:
+    """Extract Youtube playlist URL, returns empty string if query isn't one"""
+
+    # Assuming it's the first 'word' of argument
+    url = query.partition(" ")[0]
+
+    if "youtube.com/playlist?" in url and "list=" in url:
+        return url
+
+    return ""
+
+
+async def select_video(bot: discord.ext.commands.Bot, ctx: discord.ext.commands.Context, query: str, speculate=None, speculated: int = 3) -> str:
+    """Extract Youtube URL, returns empty string if failed
+
+    speculate -- callable taking URL and returning task resolving it, called for the top `speculated` results
+                 while user is choosing (tasks of results not chosen get cancelled)
+    """
 
     # If URL contained in argument
     if "youtube.com/watch?v=" in query or "youtu.be/" in query:
@@ -48,7 +164,11 @@ async def select_video(bot: discord.ext.commands.Bot, ctx: discord.ext.commands.
     # Else search youtube for video title
     else:
         try:
-            videos = youtube_search(query)
+            videos = await searches.search(query, loop=bot.loop)
+        except QuotaExceededError:
+            msg = await ctx.send("Out of Youtube searches for today, use a link instead. " + basic_emoji.get("Sadge"))
+            await msg.add_reaction(basic_emoji.get("Si"))
+            return ""
         except ConnectionError:
             msg = await ctx.send(basic_emoji.get("hackerCD") + "HTTP error. " + basic_emoji.get("Sadge"))
             await msg.add_reaction(basic_emoji.get("Si"))
@@ -81,17 +201,33 @@ async def select_video(bot: discord.ext.commands.Bot, ctx: discord.ext.commands.
                 valid_numbers.append(number_emojis[i])
                 i += 1
 
-            # Display message with available videos
-            msg = await ctx.send(poll)
-            await add_choices_message(msg, len(valid_numbers), cancellable=True)
+            urls = ["https://www.youtube.com/watch?v=" + pair[1] for pair in videos]
 
-            # Wait for user to choose
-            choice = await wait_for_choice(bot, ctx.author, msg, valid_numbers, cancellable=True)
+            # Start resolving the most likely choices while user is choosing
+            speculations = dict()
+            if speculate is not None:
+                for url in urls[:speculated]:
+                    speculations[url] = speculate(url)
 
-            await msg.delete()
+            chosen = ""
+            try:
+                # Display message with available videos
+                msg = await ctx.send(poll)
+                await add_choices_message(msg, len(valid_numbers), cancellable=True)
 
-            # Cancelled or timed out
-            if choice <= 0:
-                return ""
+                # Wait for user to choose
+                with music_metrics.timer("selection_seconds"):
+                    choice = await wait_for_choice(bot, ctx.author, msg, valid_numbers, cancellable=True)
+
+                await msg.delete()
+
+                chosen = urls[choice - 1] if choice > 0 else ""
 
-            return "https://www.youtube.com/watch?v=" + videos[choice - 1][1]
+            # Discard the rest (all of them if anything above failed)
+            finally:
+                for url, task in speculations.items():
+                    if url != chosen:
+                        task.cancel()
+
+            # Cancelled or timed out
+            return chosen
@@ -1,4 +1,5 @@
 import asyncio
+import logging
 import os
 import random
 
@@ -6,9 +7,9 @@ import discord
 from discord.ext import commands
 from pretty_help import PrettyHelp
 
-from cogs.garfield_cog import daily_garfield
 from lib.emotes import basic_emoji
-from lib.config import activities
+from lib.config import activities, stall_threshold
+from lib.watchdog import LoopWatchdog
 
 
 # Bot's token
@@ -17,6 +18,11 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 bot = commands.Bot(command_prefix="p.")
 bot.help_command = PrettyHelp(color=discord.Color.dark_red())
 
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.WARNING)
+
+# Reports commands blocking the event loop
+bot.watchdog = LoopWatchdog(bot, threshold=stall_threshold)
+
 
 async def status_changer():
     """Changes bot's activity every so often"""
@@ -51,12 +57,12 @@ async def on_ready():
     bot.load_extension("cogs.utility_cog")
     bot.load_extension("cogs.music_cog")
 
-    # Daily Garfield post
-    bot.loop.create_task(daily_garfield(bot.guilds[0].text_channels[0]))
-
     # Activities
     bot.loop.create_task(status_changer())
 
+    # Event loop stall detection
+    bot.loop.create_task(bot.watchdog.run())
+
     # Disconnect from all voice channels (if bot restarted, for example - that doesn't necessarily remove it from VC, have to do that manually)
     bot.loop.create_task(leave_voice())
 